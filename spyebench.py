@@ -0,0 +1,304 @@
+###############################################################
+###
+###   Spyeworks benchmarks
+###
+###   python3 spyebench.py recv   - reply latency and cpu time
+###                                 of the legacy busy loop reader
+###                                 against the event loop reader
+###   python3 spyebench.py decode - decoding a 10000 entry DML
+###                                 listing chunk by chunk
+###   python3 spyebench.py trigger [rate] [count] [stabletime]
+###                               - sensor edge to SPL at the player
+###                                 and to a confirmed SCP readback,
+###                                 for the legacy login path, the
+###                                 event loop client and the event
+###                                 loop client pipelining SPL and SCP,
+###                                 at rate edges per second and
+###                                 flapping at ten times that
+###
+###############################################################
+
+import socket # for the legacy reader
+import threading # for waiting on the benchmark threads
+import time # for timing
+import sys # for picking the benchmark
+import collections # for matching edges to the commands they caused
+import chardet # for the legacy reader
+import spyesensor
+from spyeworks import AsyncSpyeworks, EventLoop, Observable, ReplyDecoder, Spyeworks, SCP_END
+from spyesched import Scheduler
+from spyesensor import Sensor
+from spyemock import MockPlayer
+
+# the reader spyeworks used before the event loop client, kept here as the baseline
+def legacyRecvTimeout(mySocket,timeout=.5):
+    # set the socket to nonblocking
+    mySocket.setblocking(0)
+    # initiate the variables
+    buffer=[]
+    data=''
+    begin=time.time()
+    # start the while loop
+    while 1:
+        # if there is data and we've reached the timeout, end the while
+        if buffer and time.time()-begin > timeout:
+            break
+        # if there is no data, wait for twice the timeout
+        elif time.time()-begin > timeout*2:
+            break
+
+        # receive data
+        try:
+            data=mySocket.recv(8192)
+        except:
+            pass
+        else:
+            # if data received
+            if data:
+                # get the encoding type
+                encoding=chardet.detect(data)['encoding']
+                # add data to buffer
+                buffer.append(data.decode(encoding))
+                # reset timeout
+                begin=time.time()
+
+    # join the buffer for return
+    return ''.join(buffer)
+
+# times the legacy reader, returns lists of latencies and cpu times in seconds
+def benchLegacyRecv(port,count):
+    latency=[]
+    cpu=[]
+    for i in range(count):
+        s=socket.create_connection(('127.0.0.1',port),5)
+        s.sendall(b'LOGIN\r\n')
+        s.recv(1024)
+        begin=time.time()
+        beginCpu=time.process_time()
+        s.sendall(b'SCP\r\n')
+        legacyRecvTimeout(s)
+        latency.append(time.time()-begin)
+        cpu.append(time.process_time()-beginCpu)
+        s.close()
+    return latency,cpu
+
+# times the event loop reader on a logged in client
+def benchRecv(port,count):
+    loop=EventLoop.get()
+    client=AsyncSpyeworks('127.0.0.1',port)
+    loop.run(client.command())
+    latency=[]
+    cpu=[]
+    for i in range(count):
+        begin=time.time()
+        beginCpu=time.process_time()
+        loop.run(client.command('SCP\r\n',True,SCP_END))
+        latency.append(time.time()-begin)
+        cpu.append(time.process_time()-beginCpu)
+    loop.run(client.disconnect())
+    return latency,cpu
+
+# prints the mean of each list in milliseconds
+def report(name,latency,cpu):
+    print("%-8s latency %9.3f ms   cpu %9.3f ms per reply"%
+          (name,1000*sum(latency)/len(latency),1000*sum(cpu)/len(cpu)))
+
+def recv(count=10):
+    count=int(count)
+    player=MockPlayer(current="active").start()
+    port=player.server.server_address[1]
+    report("legacy",*benchLegacyRecv(port,count))
+    report("loop",*benchRecv(port,count))
+    player.stop()
+
+# a DML listing with the given number of entries, every third name accented
+def dmlListing(entries,filepath="c:/users/public/documents/spyeworks/content/"):
+    lines=[]
+    for i in range(entries):
+        name=("caf\u00e9 %d" if i%3==0 else "list %d")%i
+        lines.append(filepath+name+'.dml|0012345\r\n')
+    return (''.join(lines)+'\r\n').encode('utf-8')
+
+# decodes chunks the way the legacy reader did, counting chunks it couldn't decode
+def legacyDecode(chunks):
+    buffer=[]
+    errors=0
+    for data in chunks:
+        encoding=chardet.detect(data)['encoding']
+        try:
+            buffer.append(data.decode(encoding))
+        except (UnicodeDecodeError,TypeError,LookupError):
+            errors+=1
+    return ''.join(buffer),errors
+
+# decodes chunks with a cached incremental decoder
+def cachedDecode(chunks):
+    decoder=ReplyDecoder()
+    decoder.start()
+    for data in chunks:
+        decoder.feed(data)
+    return decoder.finish(),0
+
+def decode(entries=10000,chunk=8192):
+    entries=int(entries)
+    chunk=int(chunk)
+    listing=dmlListing(entries)
+    chunks=[listing[i:i+chunk] for i in range(0,len(listing),chunk)]
+    expected=listing.decode('utf-8')
+    for name,func in (("legacy",legacyDecode),("cached",cachedDecode)):
+        begin=time.process_time()
+        text,errors=func(chunks)
+        cpu=time.process_time()-begin
+        print("%-8s cpu %9.3f ms   chunks %d   failed chunks %d   correct %s"%
+              (name,1000*cpu,len(chunks),errors,text==expected))
+
+# the spyeworks class before the event loop client, a new connection for every command,
+# kept here as the baseline for the trigger benchmark
+class LegacySpyeworks(Observable):
+    def __init__(self,ipaddy,filepath,active,idle,initialValue="Offline"):
+        Observable.__init__(self,initialValue)
+        self.ipaddy,self.port=ipaddy.split(':')
+        self.filepath=filepath
+        self.active=active
+        self.idle=idle
+        self.currentList=Observable()
+
+    def login(self,cmd="",parse=False):
+        s=socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+        s.settimeout(5)
+        try:
+            s.connect((self.ipaddy,int(self.port)))
+        except:
+            self.set("Connection Error")
+            return
+        s.send(b'LOGIN\r\n')
+        if s.recv(1024).decode('ascii')[:2]=='OK':
+            self.set("Online")
+            if len(cmd)>0:
+                s.send(cmd.encode())
+                if parse:
+                    for st in legacyRecvTimeout(s,.25).split('\r\n'):
+                        if len(st[len(self.filepath):-4])>0:
+                            self.currentList.set(st[len(self.filepath):-4])
+        else:
+            self.set("Login Error")
+        s.close()
+
+    def getCurrentList(self):
+        self.login('SCP\r\n',True)
+
+    def playActive(self,force=False):
+        self.login('SPL'+self.filepath+self.active+'.dml\r\n')
+
+    def playIdle(self,force=False):
+        self.login('SPL'+self.filepath+self.idle+'.dml\r\n')
+
+# stands in for the GPIO module so edges can be fed in through Sensor.sensorChange
+class SyntheticPin:
+    BCM=IN=PUD_DOWN=BOTH=None
+    def __init__(self):
+        self.level=0
+    def setmode(self,mode):
+        pass
+    def setwarnings(self,flag):
+        pass
+    def setup(self,pin,direction,pull):
+        pass
+    def add_event_detect(self,pin,edge,callback):
+        pass
+    def input(self,pin):
+        return self.level
+
+# the value at the given percentile of a sorted list
+def percentile(values,p):
+    if not values:
+        return float('nan')
+    return values[min(len(values)-1,int(len(values)*p/100))]
+
+# feeds count alternating edges at rate per second through a sensor wired to a player the
+# way the controllers do it, returns the edge to SPL and edge to confirmed SCP latencies
+# and the switches per second the player saw
+# with pipelined the SPL and SCP of a confirmed switch go out together, splreply is what
+# the player answers SPL with
+def benchTrigger(makePlayer,rate,count,stabletime=0,confirm=False,pipelined=False,splreply=""):
+    filepath="c:/users/public/documents/spyeworks/content/"
+    mock=MockPlayer(filepath=filepath,current="idle",splreply=splreply).start()
+    pin=SyntheticPin()
+    spyesensor.GPIO=pin
+    scheduler=Scheduler()
+    worker=Scheduler()
+    scheduler.start()
+    worker.start()
+    sensor=Sensor(14,"Off",scheduler,stabletime)
+    player=makePlayer(mock.address,filepath)
+    # when the newest raw edge went in, and the edge behind each switch waiting for its SPL
+    edges=[0]
+    waiting=collections.deque()
+    spl=[]
+    scp=[]
+    arrivals=[]
+    def onCommand(received,cmd):
+        if cmd.startswith('SPL') and waiting:
+            spl.append(received-waiting.popleft())
+            arrivals.append(received)
+    mock.onCommand=onCommand
+    def switch(value,edge):
+        waiting.append(edge)
+        target=player.active if value=="On" else player.idle
+        if confirm and pipelined:
+            if player.playAndConfirm(target)==target:
+                scp.append(time.time()-edge)
+            return
+        if value=="On":
+            player.playActive(True)
+        else:
+            player.playIdle(True)
+        if confirm:
+            player.getCurrentList()
+            if player.currentList.get()==target:
+                scp.append(time.time()-edge)
+    # the controllers hand the settled edge to the player worker
+    sensor.addCallback(lambda value: worker.call(switch,value,edges[0]))
+    for i in range(count):
+        pin.level=1-pin.level
+        edges[0]=time.time()
+        sensor.sensorChange(14)
+        time.sleep(1.0/rate)
+    # let the queued switches finish
+    done=threading.Event()
+    scheduler.schedule(None,stabletime,worker.call,done.set)
+    done.wait()
+    first=edges[0]-(count-1)/rate
+    throughput=len(arrivals)/(arrivals[-1]-first) if arrivals else 0
+    scheduler.stop()
+    worker.stop()
+    mock.stop()
+    return sorted(spl),sorted(scp),throughput,sensor.counts()
+
+def reportTrigger(name,spl,scp,throughput,counts):
+    line="%-8s SPL p50 %8.2f p95 %8.2f p99 %8.2f ms"%(
+        name,1000*percentile(spl,50),1000*percentile(spl,95),1000*percentile(spl,99))
+    if scp:
+        line+="   SCP p50 %8.2f p95 %8.2f p99 %8.2f ms"%(
+            1000*percentile(scp,50),1000*percentile(scp,95),1000*percentile(scp,99))
+    print(line+"   %7.1f switches/s   edges %d raw %d emitted"%((throughput,)+counts))
+
+# with acks the mock player acknowledges SPL with OK, as some players do
+def trigger(rate=5,count=40,stabletime=0,acks=0):
+    legacy=lambda address,filepath: LegacySpyeworks(address,filepath,"active","idle")
+    loop=lambda address,filepath: Spyeworks(address,filepath,"active","idle",probe=False)
+    clients=(("legacy",legacy,False),("loop",loop,False),("pipeline",loop,True))
+    for title,edgerate in (("steady",rate),("flapping",rate*10)):
+        for confirm in (False,True):
+            print("%s, %g edges/s%s"%(title,edgerate,", confirmed by SCP" if confirm else ""))
+            for name,makePlayer,pipelined in clients:
+                # pipelining only changes confirmed switches
+                if pipelined and not confirm:
+                    continue
+                reportTrigger(name,*benchTrigger(makePlayer,edgerate,int(count),stabletime,confirm,pipelined,
+                                                 "OK\r\n" if acks else ""))
+
+if __name__ == '__main__':
+    benchmarks={'recv':recv,'decode':decode,'trigger':trigger}
+    name=sys.argv[1] if len(sys.argv)>1 else 'recv'
+    benchmarks[name](*[float(arg) for arg in sys.argv[2:]])
@@ -0,0 +1,192 @@
+###############################################################
+###
+###   Config file for the motion scripts
+###
+###############################################################
+
+import threading # for keeping writes apart and the watcher thread
+import os # for replacing the file in one step
+import select # for waiting on inotify
+import ctypes # for inotify, which the standard library doesn't wrap
+
+# the config file is one key=value per line, starting with the version of the format, then
+# the settings and a route line per zone:
+#   version=1
+#   ipaddy=10.10.9.51
+#   ...
+#   route=14|10.10.9.51|active|idle|0|10|0|0|0
+VERSION=1
+KEYS=('ipaddy','filepath','active','idle','sensorenable','activelist','activedelaytime','idlelist','idledelaytime',
+      'commandrate','commandburst','dwelltime')
+DEFAULTS={'ipaddy':"192.168.1.110",
+          'filepath':"c:/users/public/documents/spyeworks/content/",
+          'active':"active",
+          'idle':"idle",
+          'sensorenable':"T",
+          'activelist':"T",
+          'activedelaytime':"0",
+          'idlelist':"T",
+          'idledelaytime':"0",
+          # playlist commands a second to a player, how many can go at once, and seconds
+          # a playlist stays up before the next, 0 for no limit
+          'commandrate':"2",
+          'commandburst':"4",
+          'dwelltime':"0"}
+
+# reads the settings and routes from a config file, returns (values, routes, current)
+# where current is False if the file is missing or in an older format and should be written
+# files from before the keyed format have the settings on the first nine lines, or
+# the eight lines spyepirtest.py writes, and any routes after
+def loadConfig(path):
+    try:
+        with open(path,'r') as f:
+            lines=[line.rstrip('\r\n') for line in f]
+    except OSError:
+        return dict(DEFAULTS),[],False
+    values=dict(DEFAULTS)
+    routes=[]
+    if len(lines)>0 and lines[0].startswith('version='):
+        for line in lines:
+            key,sep,value=line.partition('=')
+            if not sep:
+                continue
+            if key=='route':
+                if len(value.strip())>0:
+                    routes.append(value.strip())
+            elif key in DEFAULTS:
+                values[key]=value
+        return values,routes,lines[0][8:].strip()==str(VERSION)
+    # spyepirtest.py writes ip, path, active, idle, active delay on, active delay,
+    # idle delay on and idle delay, with a delay on the sixth line
+    if len(lines)>=8 and lines[5].isdigit() and lines[6] in ("T","F"):
+        keys=('ipaddy','filepath','active','idle','activelist','activedelaytime','idlelist','idledelaytime')
+    else:
+        keys=KEYS[:9]
+    for key,line in zip(keys,lines):
+        values[key]=line
+    routes=[line.strip() for line in lines[len(keys):] if len(line.strip())>0]
+    return values,routes,False
+
+# a number setting, or the default if it isn't one
+def number(value,default=0.0):
+    try:
+        return float(value)
+    except ValueError:
+        return default
+
+# the text of a config file
+def formatConfig(values,routes):
+    lines=['version=%d'%VERSION]
+    lines+=['%s=%s'%(key,values[key]) for key in KEYS]
+    lines+=['route='+route for route in routes]
+    return '\n'.join(lines)+'\n'
+
+# writes the config file, changes within delay seconds of each other are written together
+# snapshot returns the (values, routes) to write and is called when the write happens
+# without a scheduler every change is written straight away
+class ConfigFile:
+    def __init__(self,path,snapshot,scheduler=None,delay=1.0):
+        self.path=path
+        self.snapshot=snapshot
+        self.scheduler=scheduler
+        self.delay=delay
+        self.lock=threading.Lock()
+        # the text last written, unchanged settings aren't written again
+        self.written=None
+        # number of times the file was written
+        self.writes=0
+
+    # asks for the settings to be written
+    def save(self):
+        if self.scheduler is None:
+            self.write()
+        else:
+            self.scheduler.schedule((self,'save'),self.delay,self.write)
+
+    # writes a pending change now, for shutting down
+    def flush(self):
+        if self.scheduler is not None and self.scheduler.pending((self,'save')):
+            self.scheduler.cancel((self,'save'))
+            self.write()
+
+    # writes the whole file to a temporary file and swaps it in, so a power cut leaves
+    # either the old or the new settings
+    def write(self):
+        with self.lock:
+            text=formatConfig(*self.snapshot())
+            if text==self.written:
+                return
+            temp=self.path+'.tmp'
+            with open(temp,'w') as f:
+                f.write(text)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp,self.path)
+            self.written=text
+            self.writes+=1
+
+# inotify events for a file being written or renamed into a directory
+IN_CLOSE_WRITE=0x8
+IN_MOVED_TO=0x80
+IN_CREATE=0x100
+
+# an inotify descriptor watching a directory, None where inotify isn't available
+def inotifyWatch(directory):
+    try:
+        libc=ctypes.CDLL(None,use_errno=True)
+        fd=libc.inotify_init()
+    except (OSError,AttributeError):
+        return None
+    if fd<0:
+        return None
+    if libc.inotify_add_watch(fd,os.fsencode(directory),IN_CLOSE_WRITE|IN_MOVED_TO|IN_CREATE)<0:
+        os.close(fd)
+        return None
+    return fd
+
+# calls callback from a background thread when the file changes, woken by inotify on
+# linux and otherwise checking every interval seconds
+# the file counts as changed when its inode, size or modification time do, so the
+# temporary files of an atomic write don't count until they are renamed over it
+class ConfigWatcher:
+    def __init__(self,path,callback,interval=2.0,settle=0.1):
+        self.path=os.path.abspath(path)
+        self.callback=callback
+        self.interval=interval
+        self.settle=settle
+        self.stamp=self.stat()
+        self.fd=inotifyWatch(os.path.dirname(self.path))
+        self.stopping=threading.Event()
+        self.thread=threading.Thread(target=self.run,name="configwatcher",daemon=True)
+        self.thread.start()
+
+    def stat(self):
+        try:
+            st=os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_ino,st.st_size,st.st_mtime_ns
+
+    def stop(self):
+        self.stopping.set()
+        self.thread.join()
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd=None
+
+    # watcher thread
+    def run(self):
+        while not self.stopping.is_set():
+            if self.fd is not None:
+                ready,_,_=select.select([self.fd],[],[],self.interval)
+                if ready:
+                    os.read(self.fd,4096)
+                    # let an editor finish writing before reading the file
+                    if self.stopping.wait(self.settle):
+                        return
+            elif self.stopping.wait(self.interval):
+                return
+            stamp=self.stat()
+            if stamp is not None and stamp!=self.stamp:
+                self.stamp=stamp
+                self.callback()
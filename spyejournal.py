@@ -0,0 +1,162 @@
+###############################################################
+###
+###   Event journal, an append-only record of sensor and player
+###   events
+###
+###   python3 spyejournal.py [journal file] [--follow]
+###       prints the events in the journal, with --follow keeps
+###       printing new events as they are written
+###
+###############################################################
+
+import collections # for the ring buffer
+import threading # for the writer thread
+import struct # for the record headers
+import time # for the event times and the flush intervals
+import os # for fsync and rotation
+import argparse # for the reader command line
+
+# each file starts with the magic, then each record is a header of the length of the text
+# and the unix time of the event, then the text: kind, source and value separated by tabs
+MAGIC=b'SPYEJRN1'
+HEADER=struct.Struct('<Id')
+
+# events are queued in memory by whoever records them and written by a background thread,
+# so recording never waits on the disk:
+#   maxbytes  - size a file can grow to before it is rotated
+#   backups   - number of rotated files kept, journal.1 being the newest
+#   flush     - seconds between writes of the queued events
+#   sync      - seconds between fsyncs, the SD cards are slow so this is kept long
+#   capacity  - events held in memory, the oldest are dropped if the writer falls behind
+class Journal:
+    def __init__(self,path='spyejournal.bin',maxbytes=1048576,backups=3,flush=0.5,sync=5,capacity=10000):
+        self.path=path
+        self.maxbytes=maxbytes
+        self.backups=backups
+        self.flush=flush
+        self.sync=sync
+        # appending to and popping from a deque is safe across threads without a lock
+        self.buffer=collections.deque(maxlen=capacity)
+        self.recorded=0
+        self.written=0
+        self.file=None
+        self.synctime=time.monotonic()
+        self.stopping=threading.Event()
+        self.thread=threading.Thread(target=self.run,name="journal",daemon=True)
+        self.thread.start()
+
+    # queues an event, cheap enough for the sensor callbacks
+    def record(self,kind,source,value):
+        self.buffer.append((time.time(),kind,source,value))
+        self.recorded+=1
+
+    # events lost because the buffer was full
+    def dropped(self):
+        return self.recorded-self.written-len(self.buffer)
+
+    # writes what is queued and stops the writer thread
+    def close(self):
+        self.stopping.set()
+        self.thread.join()
+
+    # writer thread
+    def run(self):
+        while not self.stopping.wait(self.flush):
+            self.write()
+        self.write(True)
+        if self.file is not None:
+            self.file.close()
+
+    # writes the queued events in one go, syncing to the card at the sync interval
+    def write(self,sync=False):
+        records=[]
+        while self.buffer:
+            when,kind,source,value=self.buffer.popleft()
+            text=('%s\t%s\t%s'%(kind,source,value)).encode('utf-8')
+            records.append(HEADER.pack(len(text),when)+text)
+        if records:
+            data=b''.join(records)
+            self.open(len(data))
+            self.file.write(data)
+            self.file.flush()
+            self.written+=len(records)
+        if self.file is not None and (sync or time.monotonic()-self.synctime>=self.sync):
+            os.fsync(self.file.fileno())
+            self.synctime=time.monotonic()
+
+    # opens the journal, rotating it first if the data wouldn't fit
+    def open(self,size):
+        if self.file is not None and self.file.tell()+size>self.maxbytes:
+            os.fsync(self.file.fileno())
+            self.file.close()
+            self.file=None
+            self.rotate()
+        if self.file is None:
+            self.file=open(self.path,'ab')
+            if self.file.tell()==0:
+                self.file.write(MAGIC)
+
+    # journal becomes journal.1, journal.1 becomes journal.2 and so on
+    def rotate(self):
+        for number in range(self.backups-1,0,-1):
+            if os.path.exists('%s.%d'%(self.path,number)):
+                os.replace('%s.%d'%(self.path,number),'%s.%d'%(self.path,number+1))
+        if self.backups>0:
+            os.replace(self.path,self.path+'.1')
+        else:
+            os.remove(self.path)
+
+# reads the events from an open journal file, yields (time, kind, source, value)
+# stops at the end of the file or at a record that hasn't been completely written
+def readRecords(f):
+    while True:
+        start=f.tell()
+        header=f.read(HEADER.size)
+        if len(header)<HEADER.size:
+            f.seek(start)
+            return
+        length,when=HEADER.unpack(header)
+        text=f.read(length)
+        if len(text)<length:
+            f.seek(start)
+            return
+        kind,source,value=text.decode('utf-8').split('\t',2)
+        yield when,kind,source,value
+
+# streams the events in a journal file, following it as it grows and rotates if asked
+def readJournal(path,follow=False,interval=0.5):
+    f=open(path,'rb')
+    if f.read(len(MAGIC))!=MAGIC:
+        f.close()
+        raise ValueError(path+" is not a journal")
+    while True:
+        for record in readRecords(f):
+            yield record
+        if not follow:
+            break
+        time.sleep(interval)
+        # the writer rotated the journal, finish this file and start on the new one once
+        # its magic has been written
+        try:
+            rotated=os.stat(path).st_ino!=os.fstat(f.fileno()).st_ino and os.path.getsize(path)>=len(MAGIC)
+        except FileNotFoundError:
+            rotated=False
+        if rotated:
+            for record in readRecords(f):
+                yield record
+            f.close()
+            f=open(path,'rb')
+            f.read(len(MAGIC))
+    f.close()
+
+if __name__ == '__main__':
+    parser=argparse.ArgumentParser(description="Print the events in a journal")
+    parser.add_argument('path',nargs='?',default='spyejournal.bin')
+    parser.add_argument('--follow',action='store_true',help="keep printing new events")
+    args=parser.parse_args()
+    try:
+        for when,kind,source,value in readJournal(args.path,args.follow):
+            print("%s.%03d %-8s %-16s %s"%(time.strftime('%Y-%m-%d %H:%M:%S',time.localtime(when)),
+                                           int(when*1000)%1000,kind,source,value),flush=True)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,170 @@
+###############################################################
+###
+###   Metrics registry with a Prometheus style text endpoint
+###
+###############################################################
+
+import threading # for guarding the values and serving them
+import bisect # for finding histogram buckets
+import os # for replacing a stale unix socket
+
+# latency buckets in seconds
+BUCKETS=(.001,.0025,.005,.01,.025,.05,.1,.25,.5,1,2.5,5,10)
+
+# counters, gauges and histograms kept in memory, read when the endpoint is scraped
+# labels are given as a dict, a value can also be a function that is called at scrape time
+# so counts already kept elsewhere cost nothing on the hot path
+class Registry:
+    def __init__(self):
+        self.lock=threading.Lock()
+        # name -> (kind, help, buckets)
+        self.metrics={}
+        # name -> {labels: value}, a histogram value is [bucket counts, sum, count]
+        self.values={}
+
+    # declares a metric, kind is counter, gauge or histogram
+    def describe(self,name,kind,help,buckets=BUCKETS):
+        with self.lock:
+            self.metrics[name]=(kind,help,buckets)
+            self.values.setdefault(name,{})
+
+    def inc(self,name,labels=None,amount=1):
+        key=labelKey(labels)
+        with self.lock:
+            values=self.values[name]
+            values[key]=values.get(key,0)+amount
+
+    def set(self,name,value,labels=None):
+        with self.lock:
+            self.values[name][labelKey(labels)]=value
+
+    # values read by calling func when scraped
+    def collect(self,name,func,labels=None):
+        self.set(name,func,labels)
+
+    # stops reporting a series, e.g. the collector of a sensor or player that has gone,
+    # which the registry would otherwise keep alive
+    def unregister(self,name,labels=None):
+        with self.lock:
+            self.values[name].pop(labelKey(labels),None)
+
+    def observe(self,name,value,labels=None):
+        key=labelKey(labels)
+        with self.lock:
+            buckets=self.metrics[name][2]
+            values=self.values[name]
+            if key not in values:
+                values[key]=[[0]*len(buckets),0.0,0]
+            histogram=values[key]
+            index=bisect.bisect_left(buckets,value)
+            if index<len(buckets):
+                histogram[0][index]+=1
+            histogram[1]+=value
+            histogram[2]+=1
+
+    # the value of a counter or gauge, for checking from the scripts
+    def get(self,name,labels=None):
+        with self.lock:
+            value=self.values[name].get(labelKey(labels),0)
+        return value() if callable(value) else value
+
+    # the metrics in the Prometheus text format
+    def render(self):
+        with self.lock:
+            metrics=dict(self.metrics)
+            values=dict((name,dict(series)) for name,series in self.values.items())
+        lines=[]
+        for name in sorted(metrics):
+            kind,help,buckets=metrics[name]
+            lines.append("# HELP %s %s"%(name,help))
+            lines.append("# TYPE %s %s"%(name,kind))
+            for key,value in sorted(values[name].items()):
+                if kind=="histogram":
+                    counts,total,count=value
+                    cumulative=0
+                    for bound,bucket in zip(buckets,counts):
+                        cumulative+=bucket
+                        lines.append("%s_bucket%s %d"%(name,labelText(key+(('le',repr(bound)),)),cumulative))
+                    lines.append("%s_bucket%s %d"%(name,labelText(key+(('le','+Inf'),)),count))
+                    lines.append("%s_sum%s %r"%(name,labelText(key),total))
+                    lines.append("%s_count%s %d"%(name,labelText(key),count))
+                else:
+                    try:
+                        value=value() if callable(value) else value
+                    except Exception:
+                        continue
+                    lines.append("%s%s %r"%(name,labelText(key),value))
+        return '\n'.join(lines)+'\n'
+
+def labelKey(labels):
+    if not labels:
+        return ()
+    return tuple(sorted((name,str(value)) for name,value in labels.items()))
+
+def labelText(key):
+    if not key:
+        return ''
+    return '{'+','.join('%s="%s"'%(name,value.replace('\\','\\\\').replace('"','\\"')) for name,value in key)+'}'
+
+# the registry the scripts report to
+metrics=Registry()
+
+# serves the registry on a background thread, the address is a port on localhost or
+# the path of a unix socket
+# the server modules are slow to import so they are only loaded when the endpoint is asked for
+def serve(address,registry=metrics):
+    import socketserver
+    import http.server
+
+    # answers any GET with the metrics text
+    class MetricsHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            body=self.server.registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type','text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length',str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        # scrapes aren't logged
+        def log_message(self,format,*args):
+            pass
+
+    class MetricsServer(socketserver.ThreadingMixIn,http.server.HTTPServer):
+        daemon_threads=True
+        allow_reuse_address=True
+
+    class UnixMetricsServer(socketserver.ThreadingMixIn,socketserver.UnixStreamServer):
+        daemon_threads=True
+
+    address=str(address)
+    if address.isdigit():
+        server=MetricsServer(('127.0.0.1',int(address)),MetricsHandler)
+    else:
+        if os.path.exists(address):
+            os.remove(address)
+        server=UnixMetricsServer(address,MetricsHandler)
+    server.registry=registry
+    threading.Thread(target=server.serve_forever,name="metrics",daemon=True).start()
+    return server
+
+metrics.describe('spyeworks_commands_total','counter',"Commands sent to the players by type")
+metrics.describe('spyeworks_connect_seconds','histogram',"Seconds to connect to a player")
+metrics.describe('spyeworks_login_seconds','histogram',"Seconds for a player to answer LOGIN")
+metrics.describe('spyeworks_command_seconds','histogram',"Seconds for a player to take a command")
+metrics.describe('spyeworks_connection_errors_total','counter',"Failed connections to the players")
+metrics.describe('spyeworks_login_errors_total','counter',"Logins refused by the players")
+metrics.describe('spyeworks_last_playlist_change_seconds','gauge',"Unix time of the last playlist sent to a player")
+metrics.describe('spyeworks_player_down','gauge',"1 while a player's circuit breaker is open")
+metrics.describe('spyeworks_deferred_total','counter',"Playlist commands kept for a player that was down")
+metrics.describe('spyeworks_verify_mismatches_total','counter',"Switches read back on a different list than expected")
+metrics.describe('spyesensor_raw_edges_total','counter',"Raw edges read from a sensor pin")
+metrics.describe('spyesensor_emitted_edges_total','counter',"Settled sensor changes passed on")
+metrics.describe('spyesched_timers','gauge',"Keyed calls waiting on a scheduler")
+metrics.describe('spyesched_queued','gauge',"Calls waiting on a scheduler")
+metrics.describe('spyeworks_queue_depth','gauge',"Playlist commands waiting to go to a player")
+metrics.describe('spyeworks_queue_superseded_total','counter',"Waiting playlist commands replaced by a newer one")
+metrics.describe('spyeworks_queue_deferred_total','counter',"Playlist commands held back by the rate limit or dwell time")
+metrics.describe('spyeworks_queue_wait_seconds','histogram',"Seconds a playlist command waited to go out")
+metrics.describe('spye_threads','gauge',"Live threads in the process")
+metrics.collect('spye_threads',threading.active_count)
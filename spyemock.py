@@ -0,0 +1,153 @@
+###############################################################
+###
+###   Mock Spyeworks player for tests and benchmarks
+###
+###   python3 spyemock.py [--port 8900] [--catalog 20]
+###       [--latency 0] [--jitter 0] [--drop 0] [--loginfail 0]
+###
+###   answers the commands the scripts use:
+###     LOGIN  - OK, or an error for a share of logins
+###     SPL    - switches the current playlist
+###     SCP    - the current playlist
+###     DML    - the playlists in the catalog, ending with an empty line
+###
+###############################################################
+
+import socketserver # for the player server
+import socket # for closing the open connections and sending replies straight away
+import threading # for running the server beside the caller
+import random # for jitter, dropped connections and failed logins
+import time # for latency and recording when commands arrive
+import argparse # for the command line
+
+# handles one connection to the mock player
+class MockConnection(socketserver.StreamRequestHandler):
+    def handle(self):
+        player=self.server.player
+        with player.lock:
+            player.connections.add(self.request)
+        # each reply goes out as soon as it is written, rather than waiting on the ack of
+        # the one before as small writes otherwise do
+        self.request.setsockopt(socket.IPPROTO_TCP,socket.TCP_NODELAY,1)
+        try:
+            for line in self.rfile:
+                reply=player.command(line.decode('utf-8','replace').rstrip('\r\n'))
+                # the player drops the connection
+                if reply is None:
+                    break
+                if len(reply)>0:
+                    self.wfile.write(reply.encode('utf-8'))
+                    self.wfile.flush()
+        # the client hung up without reading everything, as the legacy client does
+        except ConnectionResetError:
+            pass
+
+    def finish(self):
+        with self.server.player.lock:
+            self.server.player.connections.discard(self.request)
+        socketserver.StreamRequestHandler.finish(self)
+
+class MockServer(socketserver.ThreadingTCPServer):
+    daemon_threads=True
+    allow_reuse_address=True
+
+# a stand in for a spyeworks player on localhost
+#   catalog   - number of playlists on the player, named list 0, list 1...
+#   latency   - seconds before each reply, plus up to jitter seconds more
+#   drop      - share of commands after which the connection is closed without a reply
+#   loginfail - share of logins that are refused
+#   splreply  - reply sent after SPL, nothing by default
+#   strict    - ignore SPL for playlists that aren't in the catalog, as the players do
+class MockPlayer:
+    def __init__(self,host='127.0.0.1',port=0,filepath="c:/users/public/documents/spyeworks/content/",
+                 catalog=20,current="list 0",latency=0,jitter=0,drop=0,loginfail=0,splreply="",strict=False,seed=None):
+        self.filepath=filepath
+        self.catalog=["list %d"%i for i in range(catalog)]
+        self.current=current
+        self.latency=latency
+        self.jitter=jitter
+        self.drop=drop
+        self.loginfail=loginfail
+        self.splreply=splreply
+        self.strict=strict
+        self.random=random.Random(seed)
+        self.lock=threading.Lock()
+        # (time received, command) for every command, and a function called with each
+        self.commands=[]
+        self.onCommand=None
+        self.connections=set()
+        self.server=MockServer((host,port),MockConnection)
+        self.server.player=self
+        self.thread=None
+
+    # the address to give the spyeworks client
+    @property
+    def address(self):
+        host,port=self.server.server_address[:2]
+        return "%s:%d"%(host,port)
+
+    # starts answering on a background thread
+    def start(self):
+        self.thread=threading.Thread(target=self.server.serve_forever,name="mockplayer",daemon=True)
+        self.thread.start()
+        return self
+
+    # stops answering and drops the open connections, like a player going offline
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        with self.lock:
+            connections,self.connections=self.connections,set()
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    # works out the reply to a command, None drops the connection
+    def command(self,cmd):
+        received=time.time()
+        with self.lock:
+            self.commands.append((received,cmd))
+            dropped=self.random.random()<self.drop
+            delay=self.latency+self.random.random()*self.jitter
+            refused=self.random.random()<self.loginfail
+        if self.onCommand is not None:
+            self.onCommand(received,cmd)
+        if delay>0:
+            time.sleep(delay)
+        if dropped:
+            return None
+        if cmd.startswith('LOGIN'):
+            return 'ERROR\r\n' if refused else 'OK\r\n'
+        elif cmd.startswith('SPL'):
+            # the playlist path without the folder and extension
+            name=cmd[3+len(self.filepath):-4]
+            with self.lock:
+                if not self.strict or name in self.catalog:
+                    self.current=name
+            return self.splreply
+        elif cmd.startswith('SCP'):
+            with self.lock:
+                return self.filepath+self.current+'.dml\r\n'
+        elif cmd.startswith('DML'):
+            return ''.join(self.filepath+name+'.dml|0012345\r\n' for name in self.catalog)+'\r\n'
+        return ''
+
+if __name__ == '__main__':
+    parser=argparse.ArgumentParser(description="Mock Spyeworks player")
+    parser.add_argument('--host',default='127.0.0.1')
+    parser.add_argument('--port',type=int,default=8900)
+    parser.add_argument('--catalog',type=int,default=20,help="number of playlists")
+    parser.add_argument('--latency',type=float,default=0,help="seconds before each reply")
+    parser.add_argument('--jitter',type=float,default=0,help="up to this many seconds added to the latency")
+    parser.add_argument('--drop',type=float,default=0,help="share of commands that drop the connection")
+    parser.add_argument('--loginfail',type=float,default=0,help="share of logins refused")
+    args=parser.parse_args()
+    player=MockPlayer(args.host,args.port,catalog=args.catalog,latency=args.latency,jitter=args.jitter,
+                      drop=args.drop,loginfail=args.loginfail)
+    print("Mock player on "+player.address)
+    try:
+        player.server.serve_forever()
+    except KeyboardInterrupt:
+        player.server.server_close()
@@ -14,310 +14,359 @@
 #########################################################################
 
 # import libraries
+import time # for timing the startup
+started = time.time()
 import RPi.GPIO as GPIO # for the sensor
-from threading import Timer # for delay timers
-import time # for measuring spyeworks buffer timeout
-import chardet # for character encoding/decoding
-import socket # for ip comms
-
-# data object
-class Observable:
-    def __init__(self, initialValue=None):
-        self.data = initialValue
-        self.callbacks = {}
-
-    def addCallback(self, func):
-        self.callbacks[func] = 1
-
-    def delCallback(self, func):
-        del self.callback[func]
-
-    def _docallbacks(self):
-        for func in self.callbacks:
-            func(self.data)
-
-    def set(self, data):
-        self.data = data
-        self._docallbacks()
-
-    def get(self):
-        return self.data
-
-    def unset(self):
-        self.data = None
-
-# sensor instance of the observable class
-class Sensor(Observable):
-    def __init__(self, sensor=1, initialValue="Off"):
-        Observable.__init__(self,initialValue)
-        self.sensor=sensor
-        GPIO.setmode(GPIO.BCM)
-        GPIO.setwarnings(False)
-        GPIO.setup(self.sensor,GPIO.IN,GPIO.PUD_DOWN)
-        GPIO.add_event_detect(self.sensor,GPIO.BOTH,self.sensorChange)
-
-    def sensorChange(self,value):
-        if GPIO.input(value):
-            self.set("On")
+from threading import Event # for waiting for shutdown
+from functools import partial # for binding zones to callbacks
+import signal # for shutting down cleanly
+import argparse # for the command line
+from spyeworks import Observable, SpyeworksFleet, StartupTimes # for player comms
+from spyesched import Scheduler, LatestQueue # for delay timers, the dispatcher and the player queues
+from spyesensor import Sensor # for the sensors
+import spyemetrics # for the metrics endpoint
+from spyejournal import Journal # for the event history
+from spyeconfig import ConfigFile, ConfigWatcher, loadConfig, number, KEYS, DEFAULTS # for the settings
+
+# a sensor and the group of players it switches, set by a line of the routing table
+# in the config file: pin|player ips|active list|idle list|active delay|idle delay|
+# sensor stable time|sensor min on time|sensor min off time
+# blank fields use the main settings, the sensor times are in seconds and default to 0
+class Zone:
+    def __init__(self,route):
+        self.pin=parseRoute(route)[0]
+        self.setRoute(route)
+        self.sensorstate=None
+        self.spyeworks=None
+        # scheduler keys of the delay timers
+        self.activeTimer=(self.pin,'active')
+        self.idleTimer=(self.pin,'idle')
+        # flags, only touched on the scheduler thread
+        self.playIdleList=False
+
+    # reads the overrides and sensor times from a routing table line
+    def setRoute(self,route):
+        self.route=route
+        pin,self.overrides,self.debounce=parseRoute(route)
+
+    # works out the settings of the zone from its overrides and the main settings
+    def apply(self,model):
+        defaults=[model.ipaddy.get(),model.active.get(),model.idle.get(),
+                  model.activedelaytime.get(),model.idledelaytime.get()]
+        ipaddy,self.active,self.idle,self.activedelaytime,self.idledelaytime=[
+            override if len(override)>0 else default for override,default in zip(self.overrides,defaults)]
+        # get the current status of the sensor variable
+        if self.sensorstate is None:
+            self.sensorstate=Sensor(self.pin,"Off",model.scheduler,*self.debounce)
         else:
-            self.set("Off")
-
-# spyeworks instance
-class Spyeworks(Observable):
-    def __init__(self,ipaddy,filepath,active,idle,initialValue="Offline"):
-        Observable.__init__(self,initialValue)
-        self.ipaddy=ipaddy
-        self.port=8900
-        self.filepath=filepath
-        self.active=active
-        self.idle=idle
-        self.activeplaying=False
-        self.idleplaying=False
-        self.parse=False
-        self.currentList=Observable()
-        self.allLists=Observable()
-        self.getCurrentList()
-
-    def login(self,cmd=""):
-        # initiate the socket
-        s=socket.socket(socket.AF_INET,socket.SOCK_STREAM)
-        # set the socket connect timeout
-        s.settimeout(5)
-        # try to connect
-        try:
-            s.connect((self.ipaddy,self.port))
-        # connection error
-        except:
-            self.set("Connection Error")
-        # socket connected
+            self.sensorstate.stabletime=self.debounce[0]
+            self.sensorstate.mintime={"On":self.debounce[1],"Off":self.debounce[2]}
+        # initiate the spyeworks players or bring them up to date
+        if self.spyeworks is None:
+            # the controller gets the current lists once everything is up
+            self.spyeworks=SpyeworksFleet(ipaddy,model.filepath.get(),self.active,self.idle,probe=False)
         else:
-            # send the login msg
-            s.send(b'LOGIN\r\n')
-            # receive the reply
-            msg=s.recv(1024)
-            # decode the reply
-            msg=msg.decode('ascii')
-            # if it's an OK, login is good
-            if(msg[:2]=='OK'):
-                # set device to Online
-                self.set("Online")
-                # if there is a command
-                if len(cmd)>0:
-                    # send the endcoded command
-                    s.send(cmd.encode())
-                    # if the command needs to be parsed
-                    if self.parse:
-                        if self.parseType=='active':
-                            # set the active string and change the flags
-                            self.currentList.set(self.active)
-                            self.activeplaying=True
-                            self.idleplaying=False
-                        elif self.parseType=='idle':
-                            # set the idle string and change the flags
-                            self.currentList.set(self.idle)
-                            self.activeplaying=False
-                            self.idleplaying=True
-                        # reset the parse flag
-                        self.parse=False
-                        # get the strings for parsing
-                        stringsForParsing=self.recv_timeout(s).split('\r\n')
-                        # if we are pasring an all playlists response
-                        if self.parseType=='all':
-                            allListsTemp=[]
-                            # loop over strings
-                            for st in stringsForParsing:
-                                myString=st[len(self.filepath):-12]
-                                if len(myString)>0:
-                                    # add response to list
-                                    allListsTemp.append(myString)
-                            self.allLists.set(allListsTemp)
-                        # if we are parsing the current list
-                        elif self.parseType=='current':
-                            # loop over strings
-                            for st in stringsForParsing:
-                                # get the playlist response
-                                myString=st[len(self.filepath):-4]
-                                # if there is a response
-                                if len(myString)>0:
-                                    # assign response to current list
-                                    self.currentList.set(myString)
-            # login not okay         
-            else:
-                # set the device to login error
-                self.set("Login Error")
-            # close the socket connection
-            s.close()
-
-    # routine for receiving chunks of data from a socket
-    def recv_timeout(self,mySocket,timeout=.5):
-        # set the socket to nonblocking
-        mySocket.setblocking(0)
-        # initiate the variables
-        buffer=[]
-        data=''
-        begin=time.time()
-        # start the while loop
-        while 1:
-            # if there is data and we've reached the timeout, end the while
-            if buffer and time.time()-begin > timeout:
-                break
-            # if there is no data, wait for twice the timeout
-            elif time.time()-begin > timeout*2:
-                break
-            
-            # receive data
-            try:
-                data=mySocket.recv(8192)
-            except:
-                pass
-            else:
-                # if data received
-                if data:
-                    # get the encoding type
-                    encoding=chardet.detect(data)['encoding']
-                    # add data to buffer
-                    buffer.append(data.decode(encoding))
-                    # reset timeout
-                    begin=time.time()
-
-        # join the buffer for return
-        return ''.join(buffer)
-
-    def getCurrentList(self):
-        self.parse=True
-        self.parseType='current'
-        self.login('SCP\r\n')
-
-    def getAllPlaylists(self):
-        self.parse=True
-        self.parseType='all'
-        self.login('DML\r\n')
-
-    def playActive(self):
-        self.parse=True
-        self.parseType='active'
-        self.login('SPL'+self.filepath+self.active+'.dml\r\n')
-
-    def playIdle(self):
-        self.parse=True
-        self.parseType='idle'
-        self.login('SPL'+self.filepath+self.idle+'.dml\r\n')
+            self.spyeworks.ipaddy=ipaddy
+            self.spyeworks.filepath=model.filepath.get()
+            self.spyeworks.active=self.active
+            self.spyeworks.idle=self.idle
+
+# splits a routing table line into the pin, the overrides and the sensor times, raises
+# ValueError for a line that can't be used
+def parseRoute(route):
+    fields=(route.split('|')+['']*9)[:9]
+    pin=int(fields[0])
+    for delay in fields[4:6]:
+        if len(delay)>0:
+            int(delay)
+    return pin,fields[1:6],[float(field) if len(field)>0 else 0 for field in fields[6:]]
+
+# checks the delays and the routing table read from the config file, returns the
+# settings with a bad delay put back to its default, the routes that can be used and
+# a message for each problem found. A route that can't be parsed or is for a pin that
+# already has one is left out
+def checkConfig(values,routes):
+    values=dict(values)
+    problems=[]
+    for key in ('activedelaytime','idledelaytime'):
+        try:
+            int(values[key])
+        except ValueError:
+            problems.append("%s %r is not a whole number"%(key,values[key]))
+            values[key]=DEFAULTS[key]
+    usable=[]
+    pins=[]
+    for route in routes:
+        try:
+            pin=parseRoute(route)[0]
+        except ValueError:
+            problems.append("route %r can't be read"%route)
+            continue
+        if pin in pins:
+            problems.append("pin %d has more than one route"%pin)
+            continue
+        pins.append(pin)
+        usable.append(route)
+    return values,usable,problems
+
+# settings the zones are worked out from
+ZONE_KEYS = {'ipaddy','filepath','active','idle','activedelaytime','idledelaytime'}
 
 # model
 class Model:
-    def __init__(self):
-        #check to see if values are in text file, otherwise load defaults
-        try:
-            f=open('spyeconfig.txt','r')
-        # problem opening the file, load the default values
-        except:
-            self.ipaddy = Observable("192.168.1.110")
-            self.filepath = Observable("c:/users/public/documents/spyeworks/content/")
-            self.active = Observable("active")
-            self.idle = Observable("idle")
-            self.sensorenable = Observable("T")
-            self.activelist = Observable("T")
-            self.activedelaytime = Observable("0")
-            self.idlelist = Observable("T")
-            self.idledelaytime = Observable("0")
-            self.UpdateTextFile()
-        else:
-            self.ipaddy = Observable(f.readline()[:-1])
-            self.filepath = Observable(f.readline()[:-1])
-            self.active = Observable(f.readline()[:-1])
-            self.idle = Observable(f.readline()[:-1])
-            self.sensorenable = Observable(f.readline()[:-1])
-            self.activelist = Observable(f.readline()[:-1])
-            self.activedelaytime = Observable(f.readline()[:-1])
-            self.idlelist = Observable(f.readline()[:-1])
-            self.idledelaytime = Observable(f.readline()[:-1])
-        # close the file
-        f.close()
-
-        # get the current status of the sensor variable
-        self.sensorstate = Sensor(14)
-
-        # initiate the spyeworks player
-        self.spyeworks = Spyeworks(self.ipaddy.get(),self.filepath.get(),
-                                   self.active.get(),self.idle.get())
+    def __init__(self, scheduler, startup=None, writer=None):
+        self.scheduler = scheduler
+        # settings from the config file, or the defaults if there isn't one
+        values,self.routes,current=loadConfig('spyeconfig.txt')
+        # the daemon starts with what can be used, a bad line is reported and skipped but
+        # kept in the file so it can be put right
+        values,routes,problems=checkConfig(values,self.routes)
+        for problem in problems:
+            print("Config: "+problem+", not used")
+        for key in KEYS:
+            setattr(self,key,Observable(values[key]))
+        # changes are written together once they stop coming, on the writer's thread so a
+        # slow SD card never holds up the sensors
+        self.config=ConfigFile('spyeconfig.txt',self.snapshot,writer)
+        # a missing or older file is written in the current format
+        if not current:
+            self.config.write()
+        if startup is not None:
+            startup.step("config")
+
+        # without a routing table the sensor on pin 14 switches the main players
+        self.zones = [Zone(route) for route in routes or ["14"]]
+        for zone in self.zones:
+            zone.apply(self)
+        if startup is not None:
+            startup.step("sensors")
+
+        # the first zone is the main sensor and players
+        self.sensorstate = self.zones[0].sensorstate
+        self.spyeworks = self.zones[0].spyeworks
 
     ###############################################################
     ### Methods for the controller to update variables in the model
     ###############################################################
 
-    def SetIP(self, value):
-        self.ipaddy.set(value)
+    # changes several settings at once with one write and one player update,
+    # e.g. Set(active="code 42", idle="jamf")
+    def Set(self, **values):
+        for key in values:
+            if key not in KEYS:
+                raise KeyError(key)
+        for key,value in values.items():
+            getattr(self,key).set(value)
         self.UpdateTextFile()
-        # also update the spyeworks player
-        self.spyeworks.ipaddy=value
+        # also update the spyeworks players
+        if ZONE_KEYS.intersection(values):
+            self.applyZones()
+
+    def SetIP(self, value):
+        self.Set(ipaddy=value)
 
     def SetFilepath(self, value):
-        self.filepath.set(value)
-        self.UpdateTextFile()
-        # also update the spyeworks player
-        self.spyeworks.filepath=value
+        self.Set(filepath=value)
 
     def SetActive(self, value):
-        self.active.set(value)
-        self.UpdateTextFile()
-        # also update the spyeworks player
-        self.spyeworks.active=value
+        self.Set(active=value)
 
     def SetIdle(self, value):
-        self.idle.set(value)
-        self.UpdateTextFile()
-        # also update the spyeworks player
-        self.spyeworks.idle=value
+        self.Set(idle=value)
 
     def SetSensorEnable(self,value):
-        self.sensorenable.set(value)
-        self.UpdateTextFile()
+        self.Set(sensorenable=value)
 
     def SetActiveList(self, value):
-        self.activelist.set(value)
-        self.UpdateTextFile()
+        self.Set(activelist=value)
 
     def SetActiveDelayTime(self, value):
-        self.activedelaytime.set(value)
-        self.UpdateTextFile()
+        self.Set(activedelaytime=value)
 
     def SetIdleList(self, value):
-        self.idlelist.set(value)
-        self.UpdateTextFile()
+        self.Set(idlelist=value)
 
     def SetIdleDelayTime(self, value):
-        self.idledelaytime.set(value)
-        self.UpdateTextFile()
+        self.Set(idledelaytime=value)
+
+    # brings every zone up to date with the main settings
+    def applyZones(self):
+        for zone in self.zones:
+            zone.apply(self)
+
+    # reads the config file again and applies only what changed, returns the names of
+    # the settings that changed and the zones added and removed
+    # the file is checked first, a bad delay or route raises ValueError and changes nothing
+    def reload(self):
+        values,routes,current=loadConfig('spyeconfig.txt')
+        problems = checkConfig(values,routes)[2]
+        if len(problems)>0:
+            raise ValueError(', '.join(problems))
+        changed = [key for key in KEYS if getattr(self,key).get()!=values[key]]
+        for key in changed:
+            getattr(self,key).set(values[key])
+        added = []
+        removed = []
+        if routes!=self.routes:
+            self.routes = routes
+            # zones are matched up by pin, the ones kept keep their sensor, players and timers
+            zones = dict((zone.pin,zone) for zone in self.zones)
+            self.zones = []
+            for route in self.routes or ["14"]:
+                zone = zones.pop(int(route.split('|')[0]),None)
+                if zone is None:
+                    zone = Zone(route)
+                    added.append(zone)
+                else:
+                    zone.setRoute(route)
+                self.zones.append(zone)
+            removed = list(zones.values())
+            self.applyZones()
+            self.sensorstate = self.zones[0].sensorstate
+            self.spyeworks = self.zones[0].spyeworks
+        elif ZONE_KEYS.intersection(changed):
+            self.applyZones()
+        return changed,added,removed
 
     ##########################################################
-    ### Method for writing current model values to a text file
+    ### Methods for writing current model values to a text file
     ##########################################################
 
+    # the settings and routes as they are now
+    def snapshot(self):
+        return dict((key,getattr(self,key).get()) for key in KEYS),list(self.routes)
+
     def UpdateTextFile(self):
-        # write the model to a text file for tracking variable changes
-        f=open('spyeconfig.txt','w+')
-        f.write(self.ipaddy.get()+'\n'+self.filepath.get()+'\n'+self.active.get()+'\n'+self.idle.get()+'\n'+self.sensorenable.get()+'\n'+
-            self.activelist.get()+'\n'+self.activedelaytime.get()+'\n'+self.idlelist.get()+'\n'+self.idledelaytime.get()+'\n')
-        f.close()
+        # write the model to the config file once the changes settle
+        self.config.save()
 
 
 # controller, talks to views and models
 class Controller:
-    def __init__(self):
-        # create model and setup callbacks
-        self.model = Model()
-        self.model.spyeworks.addCallback(self.updatePlayerOnline)
-        self.model.spyeworks.currentList.addCallback(self.updateCurrentList)
-        self.model.sensorstate.addCallback(self.updateSensorState)
-
-        # create variables for timers
-        self.activeTimer=Timer(1, self.dummyFunc, ())
-        self.idleTimer=Timer(1, self.dummyFunc, ())
-        self.playIdleList=False
-
-        # update variables with data from model
-        self.updatePlayerOnline(self.model.spyeworks.get())
-        self.updateSensorState(self.model.sensorstate.get())
+    def __init__(self, scheduler=None, startup=None, journal=None):
+        # sensor edges and timers of every zone are handled one at a time on the scheduler thread
+        if scheduler is None:
+            scheduler=Scheduler()
+            scheduler.start()
+        self.scheduler=scheduler
+        # the first contact with the players runs on the worker so it never holds up the sensors
+        self.worker=Scheduler(name="worker")
+        self.worker.start()
+        # the config file is written on a thread of its own
+        self.writer=Scheduler(name="config")
+        self.writer.start()
+        # sensor and player events are written to the journal in the background
+        self.journal=journal
+
+        # create model
+        self.model = Model(self.scheduler, startup, self.writer)
+
+        # setup callbacks and update variables with data from model
+        for zone in self.model.zones:
+            self.addZone(zone)
+
+        # contact the players now the sensors are up
+        self.worker.call(self.probe, startup)
+
+        # pick up changes to the config file made by the gui or by hand without a restart
+        self.watcher=ConfigWatcher('spyeconfig.txt', partial(self.post,self.reloadConfig))
+
+    ##########################
+    ### Methods for scheduling
+    ##########################
+
+    # queues a call for the scheduler thread
+    def post(self, func, *args):
+        self.scheduler.call(func,*args)
+
+    # sets up the callbacks of a zone
+    def addZone(self, zone):
+        # playlist commands for the zone's players go out one at a time on a thread of the
+        # zone's own, so a slow player never holds up the other zones, and a newer one
+        # replaces one still waiting
+        zone.worker=Scheduler(name="zone %d"%zone.pin)
+        zone.worker.start()
+        zone.queue=LatestQueue(zone.worker, zone.spyeworks.ipaddy)
+        self.limitQueue(zone)
+        zone.spyeworks.addCallback(self.updatePlayerOnline)
+        zone.spyeworks.currentList.addCallback(self.updateCurrentList)
+        zone.sensorstate.addCallback(partial(self.post,self.updateSensorState,zone))
+        if self.journal is not None:
+            zone.sensorstate.addCallback(partial(self.journal.record,'sensor',zone.pin))
+            zone.spyeworks.addCallback(partial(self.journal.record,'player',zone.spyeworks.ipaddy))
+            zone.spyeworks.currentList.addCallback(partial(self.journal.record,'playlist',zone.spyeworks.ipaddy))
+            zone.spyeworks.mismatch.addCallback(partial(self.journal.record,'mismatch',zone.spyeworks.ipaddy))
+        self.updatePlayerOnline(zone.spyeworks.get())
+        self.post(self.updateSensorState,zone,zone.sensorstate.get())
+
+    # limits how fast playlist commands go to a zone's players, so a noisy sensor with no
+    # delay can't flood them, commands held back are collapsed to the newest
+    def limitQueue(self, zone):
+        zone.queue.setLimits(number(self.model.commandrate.get()),
+                             number(self.model.commandburst.get(),1),
+                             number(self.model.dwelltime.get()))
+
+    # cancels the timers and queued command of a zone taken out of the routing table and
+    # releases its sensor and players
+    def removeZone(self, zone):
+        zone.worker.cancel(zone.queue.key)
+        self.scheduler.cancel(zone.activeTimer)
+        self.scheduler.cancel(zone.idleTimer)
+        self.scheduler.cancel((zone.sensorstate,'settle'))
+        GPIO.remove_event_detect(zone.pin)
+        zone.sensorstate.unregister()
+        zone.queue.unregister()
+        zone.spyeworks.close()
+        # the zone's thread stops once a command in flight is done
+        zone.worker.call(zone.worker.stop)
+
+    # applies a changed config file, runs on the scheduler thread
+    # timers that are going keep running, a changed list or player is picked up when they
+    # fire and a changed delay applies from the next timer, unless the idle list was turned off
+    def reloadConfig(self):
+        try:
+            changed,added,removed=self.model.reload()
+        except ValueError as error:
+            print("Config not reloaded: "+str(error))
+            return
+        for zone in self.model.zones:
+            if zone not in added:
+                zone.queue.rename(zone.spyeworks.ipaddy)
+                self.limitQueue(zone)
+        for zone in removed:
+            self.removeZone(zone)
+        for zone in added:
+            self.addZone(zone)
+            zone.worker.call(zone.spyeworks.getCurrentList)
+        if 'idlelist' in changed and self.model.idlelist.get()!="T":
+            for zone in self.model.zones:
+                self.scheduler.cancel(zone.idleTimer)
+        if changed or added or removed:
+            print("Config reloaded: "+', '.join(changed+['zone %d added'%zone.pin for zone in added]+
+                                                 ['zone %d removed'%zone.pin for zone in removed]))
+
+    # gets the current list of every zone, reporting the startup time once done
+    def probe(self, startup=None):
+        for zone in self.model.zones:
+            zone.spyeworks.getCurrentList()
+        if startup is not None:
+            startup.step("first player contact")
+            print("Startup: "+startup.report())
+
+    # cancels the timers, stops the scheduler and releases the sensors and players
+    def stop(self):
+        self.watcher.stop()
+        self.model.config.flush()
+        self.writer.stop()
+        self.scheduler.stop()
+        self.worker.stop()
+        for zone in self.model.zones:
+            zone.worker.stop()
+            GPIO.remove_event_detect(zone.pin)
+            zone.spyeworks.close()
+        GPIO.cleanup()
+        if self.journal is not None:
+            self.journal.close()
 
     #################################
     ### Methods for printing to the console
@@ -333,40 +382,43 @@ class Controller:
         #print("Current List is "+value)
         pass
 
-    # dummy function for passing to timer thread
-    def dummyFunc(self):
-        pass
-
-    # handles updates to the sensor status
-    def updateSensorState(self, value):
+    # handles updates to the sensor status of a zone
+    def updateSensorState(self, zone, value):
         # updates the sensor status in the view
-        #print("Sensor is "+value)
+        #print("Sensor "+str(zone.pin)+" is "+value)
         # if the sensor is activated
         if value=="On":
             # if the idle timer is active, cancel it
-            if self.idleTimer.isAlive()==True:
-                self.idleTimer.cancel()
-            # if the idle list is playing, play the active list
-            if self.model.spyeworks.currentList.get()==self.model.idle.get():
-                self.model.spyeworks.playActive()
-            
+            self.scheduler.cancel(zone.idleTimer)
+            # play the active list, replacing an idle list still waiting to go out, the
+            # command isn't sent if the active list is already playing
+            zone.queue.put(zone.spyeworks.playActive)
+
         # if the sensor is inactive and the idle list is enabled
         elif value=="Off" and self.model.idlelist.get()=="T":
-            # if the idle timer is going (it shouldn't be, but just in case)
-            if self.idleTimer.isAlive()==True:
-                self.idleTimer.cancel()
-            # start the idle list timer
-            self.idleTimer=Timer(int(self.model.idledelaytime.get()), self.model.spyeworks.playIdle, ())
-            self.idleTimer.start()
+            # start the idle list timer, replacing one that is still going
+            self.scheduler.schedule(zone.idleTimer, int(zone.idledelaytime), zone.queue.put, zone.spyeworks.playIdle)
 
     # plays idle list when active list is finished if called for
-    def activeListTimer(self):
-        if self.playIdleList==True and self.model.sensorstate.get()=="Off" and self.model.idlelist.get()=="T":
-            self.idleTimer=Timer(int(self.model.idledelaytime.get()), self.model.spyeworks.playIdle, ())
-            self.idleTimer.start()
-        self.playIdleList=False
-
-app = Controller()
-
-while True:
-    pass
\ No newline at end of file
+    def activeListTimer(self, zone):
+        if zone.playIdleList==True and zone.sensorstate.get()=="Off" and self.model.idlelist.get()=="T":
+            self.scheduler.schedule(zone.idleTimer, int(zone.idledelaytime), zone.queue.put, zone.spyeworks.playIdle)
+        zone.playIdleList=False
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Spyeworks motion sensor interface")
+    parser.add_argument('--metrics', help="port on localhost or unix socket path to serve metrics on")
+    parser.add_argument('--journal', default='spyejournal.bin', help="event journal file, empty for none")
+    args = parser.parse_args()
+    startup = StartupTimes(started)
+    startup.step("import")
+    if args.metrics:
+        spyemetrics.serve(args.metrics)
+    app = Controller(startup=startup, journal=Journal(args.journal) if args.journal else None)
+
+    # sleep until asked to stop, the sensor and scheduler threads do the work
+    stopping = Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stopping.set())
+    stopping.wait()
+    app.stop()
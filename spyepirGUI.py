@@ -22,302 +22,111 @@
 #########################################################################
 
 # load imports
+import time # for timing the startup
+started = time.time()
 import tkinter as tk # for gui
-from threading import Timer # for delay timers
-import socket # for connecting with ip devices
 import ipaddress # for validating ip addresses
 import re # regex for validating text feilds
-import chardet # for character encoding/decoding
-import time # for measuring spyeworks buffer timeout
-try:
-    import RPi.GPIO as GPIO # for using sensor inputs
-except:
-    dev_mode=1
-else:
-    dev_mode=0
-
-# data object
-class Observable:
-    def __init__(self, initialValue=None):
-        self.data = initialValue
-        self.callbacks = {}
-
-    def addCallback(self, func):
-        self.callbacks[func] = 1
-
-    def delCallback(self, func):
-        del self.callback[func]
-
-    def _docallbacks(self):
-        for func in self.callbacks:
-            func(self.data)
-
-    def set(self, data):
-        self.data = data
-        self._docallbacks()
-
-    def get(self):
-        return self.data
-
-    def unset(self):
-        self.data = None
-
-# sensor instance of the observable class
-class Sensor(Observable):
-    def __init__(self, sensor=1, initialValue="Off"):
-        Observable.__init__(self,initialValue)
-        self.sensor=sensor
-        if dev_mode==0:
-            GPIO.setmode(GPIO.BCM)
-            GPIO.setwarnings(False)
-            GPIO.setup(self.sensor,GPIO.IN,GPIO.PUD_DOWN)
-            GPIO.add_event_detect(self.sensor,GPIO.BOTH,self.sensorChange)
-
-    def sensorChange(self,value):
-        if dev_mode==0:
-            if GPIO.input(value):
-                self.set("On")
-            else:
-                self.set("Off")
-        else:
-            self.set("Off")
-
-class Spyeworks(Observable):
-    def __init__(self,ipaddy,filepath,active,idle,initialValue="Offline"):
-        Observable.__init__(self,initialValue)
-        self.ipaddy=ipaddy
-        self.port=8900
-        self.filepath=filepath
-        self.active=active
-        self.idle=idle
-        self.activeplaying=False
-        self.idleplaying=False
-        self.parse=False
-        self.currentList=Observable()
-        self.allLists=Observable()
-        self.getCurrentList()
-
-    def login(self,cmd=""):
-        # initiate the socket
-        s=socket.socket(socket.AF_INET,socket.SOCK_STREAM)
-        # set the socket connect timeout
-        s.settimeout(5)
-        # try to connect
-        try:
-            s.connect((self.ipaddy,self.port))
-        # connection error
-        except:
-            self.set("Connection Error")
-        # socket connected
-        else:
-            # send the login msg
-            s.send(b'LOGIN\r\n')
-            # receive the reply
-            msg=s.recv(1024)
-            # decode the reply
-            msg=msg.decode('ascii')
-            # if it's an OK, login is good
-            if(msg[:2]=='OK'):
-                # set device to Online
-                self.set("Online")
-                # if there is a command
-                if len(cmd)>0:
-                    # send the endcoded command
-                    s.send(cmd.encode())
-                    # if the command needs to be parsed
-                    if self.parse:
-                        if self.parseType=='active':
-                            # set the active string and change the flags
-                            self.currentList.set(self.active)
-                            self.activeplaying=True
-                            self.idleplaying=False
-                        elif self.parseType=='idle':
-                            # set the idle string and change the flags
-                            self.currentList.set(self.idle)
-                            self.activeplaying=False
-                            self.idleplaying=True
-                        # reset the parse flag
-                        self.parse=False
-                        # get the strings for parsing
-                        stringsForParsing=self.recv_timeout(s).split('\r\n')
-                        # if we are pasring an all playlists response
-                        if self.parseType=='all':
-                            allListsTemp=[]
-                            # loop over strings
-                            for st in stringsForParsing:
-                                myString=st[len(self.filepath):-12]
-                                if len(myString)>0:
-                                    # add response to list
-                                    allListsTemp.append(myString)
-                            self.allLists.set(allListsTemp)
-                        # if we are parsing the current list
-                        elif self.parseType=='current':
-                            # loop over strings
-                            for st in stringsForParsing:
-                                # get the playlist response
-                                myString=st[len(self.filepath):-4]
-                                # if there is a response
-                                if len(myString)>0:
-                                    # assign response to current list
-                                    self.currentList.set(myString)
-            # login not okay         
-            else:
-                # set the device to login error
-                self.set("Login Error")
-            # close the socket connection
-            s.close()
-
-    # routine for receiving chunks of data from a socket
-    def recv_timeout(self,mySocket,timeout=.5):
-        # set the socket to nonblocking
-        mySocket.setblocking(0)
-        # initiate the variables
-        buffer=[]
-        data=''
-        begin=time.time()
-        # start the while loop
-        while 1:
-            # if there is data and we've reached the timeout, end the while
-            if buffer and time.time()-begin > timeout:
-                break
-            # if there is no data, wait for twice the timeout
-            elif time.time()-begin > timeout*2:
-                break
-            
-            # receive data
-            try:
-                data=mySocket.recv(8192)
-            except:
-                pass
-            else:
-                # if data received
-                if data:
-                    # get the encoding type
-                    encoding=chardet.detect(data)['encoding']
-                    # add data to buffer
-                    buffer.append(data.decode(encoding))
-                    # reset timeout
-                    begin=time.time()
-
-        # join the buffer for return
-        return ''.join(buffer)
-
-    def getCurrentList(self):
-        self.parse=True
-        self.parseType='current'
-        self.login('SCP\r\n')
-
-    def getAllPlaylists(self):
-        self.parse=True
-        self.parseType='all'
-        self.login('DML\r\n')
-
-    def playActive(self):
-        self.parse=True
-        self.parseType='active'
-        self.login('SPL'+self.filepath+self.active+'.dml\r\n')
-
-    def playIdle(self):
-        self.parse=True
-        self.parseType='idle'
-        self.login('SPL'+self.filepath+self.idle+'.dml\r\n')
+import queue # for handing updates to the gui thread
+from functools import partial # for wrapping callbacks
+from spyeworks import Observable, SpyeworksFleet, StartupTimes # for player comms
+from spyesched import Scheduler, LatestQueue # for delay timers and the player queue
+from spyesensor import Sensor # for the sensor
+from spyeconfig import ConfigFile, loadConfig, number, KEYS # for the settings
+
+# settings the players are set up from
+PLAYER_KEYS = {'ipaddy','filepath','active','idle'}
 
 # model
 class Model:
-    def __init__(self):
-        #check to see if values are in text file, otherwise load defaults
-        try:
-            f=open('spyeconfig.txt','r')
-        # problem opening the file, load the default values
-        except:
-            self.ipaddy = Observable("192.168.1.110")
-            self.filepath = Observable("c:/users/public/documents/spyeworks/content/")
-            self.active = Observable("active")
-            self.idle = Observable("idle")
-            self.sensorenable = Observable("T")
-            self.activelist = Observable("T")
-            self.activedelaytime = Observable("0")
-            self.idlelist = Observable("T")
-            self.idledelaytime = Observable("0")
-            self.UpdateTextFile()
-        else:
-            self.ipaddy = Observable(f.readline()[:-1])
-            self.filepath = Observable(f.readline()[:-1])
-            self.active = Observable(f.readline()[:-1])
-            self.idle = Observable(f.readline()[:-1])
-            self.sensorenable = Observable(f.readline()[:-1])
-            self.activelist = Observable(f.readline()[:-1])
-            self.activedelaytime = Observable(f.readline()[:-1])
-            self.idlelist = Observable(f.readline()[:-1])
-            self.idledelaytime = Observable(f.readline()[:-1])
-        # close the file
-        f.close()
+    def __init__(self, scheduler, startup=None, writer=None):
+        self.scheduler = scheduler
+        # settings from the config file, or the defaults if there isn't one, the zone
+        # routing table used by the console script is kept as it is
+        values,self.routes,current=loadConfig('spyeconfig.txt')
+        for key in KEYS:
+            setattr(self,key,Observable(values[key]))
+        # changes are written together once they stop coming, on the writer's thread so a
+        # slow SD card never holds up the sensors
+        self.config=ConfigFile('spyeconfig.txt',self.snapshot,writer)
+        # a missing or older file is written in the current format
+        if not current:
+            self.config.write()
+        if startup is not None:
+            startup.step("config")
 
         # get the current status of the sensor variable
-        self.sensorstate = Sensor(14)
+        self.sensorstate = Sensor(14,"Off",self.scheduler)
+        if startup is not None:
+            startup.step("sensors")
 
-        # initiate the spyeworks player
-        self.spyeworks = Spyeworks(self.ipaddy.get(),self.filepath.get(),
-                                   self.active.get(),self.idle.get())
+        # initiate the spyeworks players, the ip address setting can list several
+        # the controller gets the current list once the window is up
+        self.spyeworks = SpyeworksFleet(self.ipaddy.get(),self.filepath.get(),
+                                        self.active.get(),self.idle.get(),probe=False)
 
     ###############################################################
     ### Methods for the controller to update variables in the model
     ###############################################################
 
-    def SetIP(self, value):
-        self.ipaddy.set(value)
+    # changes several settings at once with one write and one player update,
+    # e.g. Set(active="code 42", idle="jamf")
+    def Set(self, **values):
+        for key in values:
+            if key not in KEYS:
+                raise KeyError(key)
+        for key,value in values.items():
+            getattr(self,key).set(value)
         self.UpdateTextFile()
-        # also update the spyeworks player
-        self.spyeworks.ipaddy=value
+        # also update the spyeworks players
+        if PLAYER_KEYS.intersection(values):
+            self.applyPlayers()
+
+    def SetIP(self, value):
+        self.Set(ipaddy=value)
 
     def SetFilepath(self, value):
-        self.filepath.set(value)
-        self.UpdateTextFile()
-        # also update the spyeworks player
-        self.spyeworks.filepath=value
+        self.Set(filepath=value)
 
     def SetActive(self, value):
-        self.active.set(value)
-        self.UpdateTextFile()
-        # also update the spyeworks player
-        self.spyeworks.active=value
+        self.Set(active=value)
 
     def SetIdle(self, value):
-        self.idle.set(value)
-        self.UpdateTextFile()
-        # also update the spyeworks player
-        self.spyeworks.idle=value
+        self.Set(idle=value)
 
     def SetSensorEnable(self,value):
-        self.sensorenable.set(value)
-        self.UpdateTextFile()
+        self.Set(sensorenable=value)
 
     def SetActiveList(self, value):
-        self.activelist.set(value)
-        self.UpdateTextFile()
+        self.Set(activelist=value)
 
     def SetActiveDelayTime(self, value):
-        self.activedelaytime.set(value)
-        self.UpdateTextFile()
+        self.Set(activedelaytime=value)
 
     def SetIdleList(self, value):
-        self.idlelist.set(value)
-        self.UpdateTextFile()
+        self.Set(idlelist=value)
 
     def SetIdleDelayTime(self, value):
-        self.idledelaytime.set(value)
-        self.UpdateTextFile()
+        self.Set(idledelaytime=value)
+
+    # brings the spyeworks players up to date with the settings
+    def applyPlayers(self):
+        self.spyeworks.ipaddy=self.ipaddy.get()
+        self.spyeworks.filepath=self.filepath.get()
+        self.spyeworks.active=self.active.get()
+        self.spyeworks.idle=self.idle.get()
 
     ##########################################################
-    ### Method for writing current model values to a text file
+    ### Methods for writing current model values to a text file
     ##########################################################
 
+    # the settings and routes as they are now
+    def snapshot(self):
+        return dict((key,getattr(self,key).get()) for key in KEYS),list(self.routes)
+
     def UpdateTextFile(self):
-        # write the model to a text file for tracking variable changes
-        f=open('spyeconfig.txt','w+')
-        f.write(self.ipaddy.get()+'\n'+self.filepath.get()+'\n'+self.active.get()+'\n'+self.idle.get()+'\n'+self.sensorenable.get()+'\n'+
-            self.activelist.get()+'\n'+self.activedelaytime.get()+'\n'+self.idlelist.get()+'\n'+self.idledelaytime.get()+'\n')
-        f.close()
+        # write the model to the config file once the changes settle
+        self.config.save()
 
 # main view
 class View(tk.Toplevel):
@@ -451,9 +260,9 @@ class View(tk.Toplevel):
     def updateOnline(self, value):
         self.spyeworksonline.config(text="Player Status: "+value) 
 
-    # changes the list displayed to current 
+    # changes the list displayed to current, which isn't known until the player answers
     def updateCurrentList(self, value):
-        self.spyeworkscurrentlist.config(text="Current Playlist: "+value) 
+        self.spyeworkscurrentlist.config(text="Current Playlist: "+(value if value is not None else "Unknown")) 
         
     # changes the lists available
     def updateAllLists(self, value):
@@ -517,15 +326,15 @@ class IPChangerWidget(BasicChangerWidget):
         self.geometry('%dx%d+%d+%d' % (300,200,350,250))
         self.okButton.config(command=self.validateIP)
 
-    # validates the value entered to see if it is a valid ip address
+    # validates the value entered to see if it is a valid ip address, or several separated by commas
     def validateIP(self):
         try:
-            ip=ipaddress.ip_address(self.value.get())
+            ips=[str(ipaddress.ip_address(ip.strip())) for ip in self.value.get().split(',')]
         except: # IP is invalid
             # throw an error message
             self.errormsg.config(text=self.value.get()+" is not a valid IP address.")
         else: # IP is valid
-            self.app.newIP(self.value.get())
+            self.app.newIP(','.join(ips))
             self.destroy()
         
 # popup window for setting the filepath
@@ -628,10 +437,34 @@ class IdleDelayTimeChangerWidget(BasicChangerWidget):
 
 # controller, talks to views and models
 class Controller:
-    def __init__(self, root):
-
-        # create modle and setup callbacks
-        self.model = Model()
+    def __init__(self, root, scheduler=None, startup=None):
+
+        # start the scheduler for the sensor and delay timers
+        if scheduler is None:
+            scheduler=Scheduler()
+            scheduler.start()
+        self.scheduler=scheduler
+        # player commands run one at a time on the worker, never on the gui thread
+        self.worker=Scheduler(name="worker")
+        self.worker.start()
+        # the config file is written on a thread of its own
+        self.writer=Scheduler(name="config")
+        self.writer.start()
+        # calls for the gui thread from the other threads, drained by the tk main loop
+        self.root=root
+        self.uiqueue=queue.Queue()
+
+        # create modle and setup callbacks, the player and sensor update from other threads
+        self.model = Model(self.scheduler, startup, self.writer)
+        # playlist commands, a newer one replaces one still waiting, held back to the rate
+        # and dwell time in the config file
+        self.switches=LatestQueue(self.worker, self.model.spyeworks.ipaddy,
+                                  number(self.model.commandrate.get()),
+                                  number(self.model.commandburst.get(),1),
+                                  number(self.model.dwelltime.get()))
+        # the player notifications run on the gui thread, a burst of changes is shown once
+        for observable in (self.model.spyeworks,self.model.spyeworks.currentList,self.model.spyeworks.allLists):
+            observable.dispatch=self.ui
         self.model.spyeworks.addCallback(self.updatePlayerOnline)
         self.model.spyeworks.currentList.addCallback(self.updateCurrentList)
         self.model.spyeworks.allLists.addCallback(self.updateAllLists)
@@ -639,7 +472,7 @@ class Controller:
         self.model.filepath.addCallback(self.updateFilepath)
         self.model.active.addCallback(self.updateActive)
         self.model.idle.addCallback(self.updateIdle)
-        self.model.sensorstate.addCallback(self.updateSensorState)
+        self.model.sensorstate.addCallback(partial(self.scheduler.call,self.updateSensorState))
         self.model.activedelaytime.addCallback(self.updateActiveDelayTime)
         self.model.idledelaytime.addCallback(self.updateIdleDelayTime)
 
@@ -650,8 +483,6 @@ class Controller:
         self.IdleList.set(self.model.idlelist.get())
         self.SensorEnable=tk.StringVar()
         self.SensorEnable.set(self.model.sensorenable.get())
-        self.activeTimer=Timer(1, self.dummyFunc, ())
-        self.idleTimer=Timer(1, self.dummyFunc, ())
         self.playIdleList=False
 
         # create main view and link edit btns to funcs
@@ -674,9 +505,46 @@ class Controller:
         self.updateFilepath(self.model.filepath.get())
         self.updateActive(self.model.active.get())
         self.updateIdle(self.model.idle.get())
-        self.updateSensorState(self.model.sensorstate.get())
+        self.scheduler.call(self.updateSensorState,self.model.sensorstate.get())
         self.updateActiveDelayTime(self.model.activedelaytime.get())
         self.updateIdleDelayTime(self.model.idledelaytime.get())
+
+        # start handling updates from the other threads
+        self.drainUI()
+        if startup is not None:
+            startup.step("window")
+
+        # contact the players now the window is up, the playlists shown until then
+        # come from the catalog cache
+        self.worker.call(self.probe, startup)
+        self.worker.call(self.model.spyeworks.getAllPlaylists)
+
+    # gets the current list, reporting the startup time once done
+    def probe(self, startup=None):
+        self.model.spyeworks.getCurrentList()
+        if startup is not None:
+            startup.step("first player contact")
+            print("Startup: "+startup.report())
+
+    ######################################################
+    ### Methods for getting updates onto the gui thread
+    ######################################################
+
+    # queues a call for the gui thread
+    def ui(self, func, *args):
+        self.uiqueue.put((func,args))
+
+    # runs the queued gui calls, then checks again shortly, even if one of them failed
+    def drainUI(self):
+        try:
+            while True:
+                try:
+                    func,args=self.uiqueue.get_nowait()
+                except queue.Empty:
+                    break
+                func(*args)
+        finally:
+            self.root.after(20, self.drainUI)
     
     #################################################################
     ### Methods for launching the changer popup for changing settings
@@ -719,6 +587,7 @@ class Controller:
     # sets the new ip address returned from the validate ip function
     def newIP(self, value):
         self.model.SetIP(value)
+        self.switches.rename(value)
 
     # sets the new filepath returned from the validate filepath function
     def newFilepath(self, value):
@@ -777,55 +646,42 @@ class Controller:
         self.model.SetSensorEnable(self.SensorEnable.get())
         # if the sensor has been disabled, cancel any active timers
         if self.SensorEnable.get()=="F":
-            if self.activeTimer.isAlive():
-                self.activeTimer.cancel()
-            if self.idleTimer.isAlive():
-                self.idleTimer.cancel()
-
-    # dummy function for passing to timer thread
-    def dummyFunc(self):
-        pass
+            self.scheduler.cancel('active')
+            self.scheduler.cancel('idle')
 
-    # handles updates to the sensor status
+    # handles updates to the sensor status, runs on the scheduler thread
     def updateSensorState(self, value):
         # updates the sensor status in the view
-        self.view.updateSensor(value)
+        self.ui(self.view.updateSensor,value)
         # sensor effects
         # if sensor is enabled
-        if self.SensorEnable.get()=="T":
+        if self.model.sensorenable.get()=="T":
             # if the sensor is activated
             if value=="On":
                 # if the idle timer is active, cancel it
-                if self.idleTimer.isAlive()==True:
-                    self.idleTimer.cancel()
+                self.scheduler.cancel('idle')
                 # if the active timer is on and the active list is enabled, restart the active timer
-                if self.activeTimer.isAlive()==True and self.model.activelist.get()=="T":
-                    self.activeTimer.cancel()
-                    self.activeTimer=Timer(int(self.model.activedelaytime.get()), self.activeListTimer, ())
-                    self.activeTimer.start()
+                if self.scheduler.pending('active') and self.model.activelist.get()=="T":
+                    self.scheduler.schedule('active', int(self.model.activedelaytime.get()), self.activeListTimer)
                 else:
-                    self.model.spyeworks.playActive()
-                    self.activeTimer=Timer(int(self.model.activedelaytime.get()), self.activeListTimer, ())
-                    self.activeTimer.start()
+                    self.switches.put(self.model.spyeworks.playActive)
+                    self.scheduler.schedule('active', int(self.model.activedelaytime.get()), self.activeListTimer)
                 
             # if the sensor is inactive and the idle list is enabled
             elif value=="Off" and self.model.idlelist.get()=="T":
                 # if the idle timer is going (it shouldn't be, but just in case)
-                if self.idleTimer.isAlive()==True:
-                    self.idleTimer.cancel()
+                self.scheduler.cancel('idle')
                 # if the active list timer is running and the active list is enabled
-                if self.activeTimer.isAlive()==True and self.model.activelist.get()=="T":
+                if self.scheduler.pending('active') and self.model.activelist.get()=="T":
                     self.playIdleList=True
                 # if the active timer is not running or the active list isn't enabled
                 else:
-                    self.idleTimer=Timer(int(self.model.idledelaytime.get()), self.model.spyeworks.playIdle, ())
-                    self.idleTimer.start()
+                    self.scheduler.schedule('idle', int(self.model.idledelaytime.get()), self.switches.put, self.model.spyeworks.playIdle)
 
     # plays idle list when active list is finished if called for
     def activeListTimer(self):
         if self.playIdleList==True and self.model.sensorstate.get()=="Off" and self.model.idlelist.get()=="T":
-            self.idleTimer=Timer(int(self.model.idledelaytime.get()), self.model.spyeworks.playIdle, ())
-            self.idleTimer.start()
+            self.scheduler.schedule('idle', int(self.model.idledelaytime.get()), self.switches.put, self.model.spyeworks.playIdle)
         self.playIdleList=False
 
     # updates the active delay in the view
@@ -845,7 +701,12 @@ class Controller:
         self.view.updateIdleDelayTime(value)
 
 if __name__ == '__main__':
+    startup = StartupTimes(started)
+    startup.step("import")
     root = tk.Tk()
     root.withdraw()
-    app = Controller(root)
+    app = Controller(root, startup=startup)
     root.mainloop()
+    # write any settings changed just before the window closed
+    app.model.config.flush()
+    app.writer.stop()
@@ -0,0 +1,224 @@
+###############################################################
+###
+###   Scheduler, one thread running delayed and queued calls
+###
+###############################################################
+
+import heapq # for keeping the deadlines in order
+import itertools # for numbering the calls
+import threading # for the scheduler thread
+import time # for the default clock
+import traceback # for reporting calls that fail
+from spyemetrics import metrics # for the timer counts
+
+# a clock running speed times as fast as time.monotonic, so the delay timers on a scheduler
+# using it go off that much sooner, e.g. a 10 second idle delay after 10 ms at 1000x
+class ScaledClock:
+    def __init__(self,speed=1.0):
+        self.speed=speed
+        self.started=time.monotonic()
+
+    def __call__(self):
+        return self.started+(time.monotonic()-self.started)*self.speed
+
+# runs calls at their deadlines on a single thread, calls scheduled under a key replace
+# the earlier call with that key so delay timers can be restarted and cancelled cheaply
+class Scheduler:
+    # the clock can be swapped out, e.g. for one that is moved on by hand and driven with
+    # runPending, speed is how many clock seconds pass per real second and without a clock
+    # the scheduler runs on a ScaledClock going at that speed
+    def __init__(self,clock=None,speed=1.0,name="scheduler"):
+        self.name=name
+        if clock is None:
+            clock=time.monotonic if speed==1.0 else ScaledClock(speed)
+        self.clock=clock
+        self.speed=speed
+        # (deadline, number, key, func, args) in deadline order
+        self.heap=[]
+        # number of the live call for each key
+        self.keys={}
+        self.counter=itertools.count()
+        self.condition=threading.Condition()
+        self.running=False
+        self.thread=None
+        metrics.collect('spyesched_timers',self.count,{'scheduler':name})
+        metrics.collect('spyesched_queued',self.waiting,{'scheduler':name})
+
+    # starts the scheduler thread
+    def start(self):
+        self.running=True
+        self.thread=threading.Thread(target=self.run,name=self.name,daemon=True)
+        self.thread.start()
+
+    # drops every pending call and stops the scheduler thread
+    def stop(self):
+        with self.condition:
+            self.running=False
+            self.heap=[]
+            self.keys={}
+            self.condition.notify()
+        metrics.unregister('spyesched_timers',{'scheduler':self.name})
+        metrics.unregister('spyesched_queued',{'scheduler':self.name})
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+
+    # runs func(*args) after delay seconds, replacing any pending call with the same key
+    def schedule(self,key,delay,func,*args):
+        with self.condition:
+            number=next(self.counter)
+            if key is not None:
+                self.keys[key]=number
+            heapq.heappush(self.heap,(self.clock()+delay,number,key,func,args))
+            self.condition.notify()
+
+    # runs func(*args) on the scheduler thread as soon as possible, in the order queued
+    def call(self,func,*args):
+        self.schedule(None,0,func,*args)
+
+    # cancels the pending call with the key
+    def cancel(self,key):
+        with self.condition:
+            self.keys.pop(key,None)
+
+    # checks if there is a call pending with the key
+    def pending(self,key):
+        return key in self.keys
+
+    # number of keyed calls waiting
+    def count(self):
+        return len(self.keys)
+
+    # number of calls waiting, keyed or not
+    def waiting(self):
+        with self.condition:
+            return sum(1 for deadline,number,key,func,args in self.heap
+                       if key is None or self.keys.get(key)==number)
+
+    # takes the next call that is due, returns (call, None) or (None, seconds to wait)
+    def next(self):
+        while self.heap:
+            deadline,number,key,func,args=self.heap[0]
+            # skip calls that were cancelled or replaced
+            if key is not None and self.keys.get(key)!=number:
+                heapq.heappop(self.heap)
+                continue
+            wait=deadline-self.clock()
+            if wait>0:
+                return None,wait
+            heapq.heappop(self.heap)
+            if key is not None:
+                del self.keys[key]
+            return (func,args),None
+        return None,None
+
+    # runs every call that is due by the clock, for driving the scheduler without its thread
+    def runPending(self):
+        while True:
+            with self.condition:
+                call,wait=self.next()
+            if call is None:
+                return wait
+            self.execute(call)
+
+    # runs one call, a failing call doesn't stop the scheduler
+    def execute(self,call):
+        func,args=call
+        try:
+            func(*args)
+        except Exception:
+            traceback.print_exc()
+
+    # scheduler thread
+    def run(self):
+        while True:
+            with self.condition:
+                while self.running:
+                    call,wait=self.next()
+                    if call is not None:
+                        break
+                    # sleep until the next deadline or until something is scheduled
+                    self.condition.wait(None if wait is None else wait/self.speed)
+                if not self.running:
+                    return
+            self.execute(call)
+
+# latest wins queue of calls for one player on a scheduler, a call put while an earlier
+# one is still waiting replaces it, so after a burst of sensor changes only the newest
+# playlist goes out. The calls run one at a time on the scheduler thread in the order put
+# the calls can be limited to rate a second in bursts of up to burst, with at least dwell
+# seconds between them so a playlist stays up for a while, a call held back waits on the
+# scheduler where a newer one still replaces it. A call that returns False sent nothing,
+# e.g. the playlist was already playing, and counts against neither limit
+class LatestQueue:
+    def __init__(self,scheduler,name,rate=0,burst=1,dwell=0):
+        self.scheduler=scheduler
+        # the player the queue is for, used to label the metrics
+        self.name=name
+        self.key=(self,'latest')
+        self.superseded=0
+        self.deferred=0
+        self.setLimits(rate,burst,dwell)
+        # token bucket and when the last call went out
+        self.tokens=self.burst
+        self.refilled=self.scheduler.clock()
+        self.sent=None
+        metrics.collect('spyeworks_queue_depth',self.depth,{'player':name})
+
+    def depth(self):
+        return int(self.scheduler.pending(self.key))
+
+    # reports the queue under a new player name
+    def rename(self,name):
+        if name!=self.name:
+            self.unregister()
+            self.name=name
+            metrics.collect('spyeworks_queue_depth',self.depth,{'player':name})
+
+    # stops reporting the queue, for a player that is no longer used
+    def unregister(self):
+        metrics.unregister('spyeworks_queue_depth',{'player':self.name})
+
+    # 0 turns a limit off
+    def setLimits(self,rate=0,burst=1,dwell=0):
+        self.rate=rate
+        self.burst=max(1,burst)
+        self.dwell=dwell
+
+    def put(self,func,*args):
+        if self.scheduler.pending(self.key):
+            self.superseded+=1
+            metrics.inc('spyeworks_queue_superseded_total',{'player':self.name})
+        self.scheduler.schedule(self.key,0,self.send,self.scheduler.clock(),func,args)
+
+    # seconds until a call can go out, taking a token if it can go now
+    def take(self):
+        now=self.scheduler.clock()
+        wait=0
+        if self.sent is not None:
+            wait=self.dwell-(now-self.sent)
+        if self.rate>0:
+            self.tokens=min(self.burst,self.tokens+(now-self.refilled)*self.rate)
+            self.refilled=now
+            if self.tokens<1:
+                wait=max(wait,(1-self.tokens)/self.rate)
+        if wait>0:
+            return wait
+        if self.rate>0:
+            self.tokens-=1
+        self.sent=now
+        return 0
+
+    def send(self,queued,func,args):
+        sent=self.sent
+        wait=self.take()
+        if wait>0:
+            self.deferred+=1
+            metrics.inc('spyeworks_queue_deferred_total',{'player':self.name})
+            self.scheduler.schedule(self.key,wait,self.send,queued,func,args)
+            return
+        metrics.observe('spyeworks_queue_wait_seconds',self.scheduler.clock()-queued,{'player':self.name})
+        # nothing went out, the dwell still runs from the last real change and the token is given back
+        if func(*args) is False:
+            self.sent=sent
+            if self.rate>0:
+                self.tokens=min(self.burst,self.tokens+1)
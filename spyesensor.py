@@ -0,0 +1,92 @@
+###############################################################
+###
+###   Motion sensor class
+###
+###############################################################
+
+import time # for the default clock
+from spyeworks import Observable
+from spyemetrics import metrics # for the edge counts
+try:
+    import RPi.GPIO as GPIO # for using sensor inputs
+except:
+    GPIO=None
+
+# sensor instance of the observable class, raw edges from the pin are only passed on
+# once they have settled:
+#   stabletime - seconds a new reading has to hold before it counts
+#   mintimeon  - seconds the sensor stays On before it can go Off
+#   mintimeoff - seconds the sensor stays Off before it can go On
+# debouncing needs a scheduler, without one every edge is passed on
+class Sensor(Observable):
+    def __init__(self, sensor=1, initialValue="Off", scheduler=None, stabletime=0, mintimeon=0, mintimeoff=0):
+        Observable.__init__(self,initialValue)
+        self.sensor=sensor
+        self.scheduler=scheduler
+        self.stabletime=stabletime
+        self.mintime={"On":mintimeon,"Off":mintimeoff}
+        # counters for raw edges seen and settled changes passed on
+        self.rawEdges=0
+        self.emittedEdges=0
+        # last raw reading and when the readings last changed, guarded by the observable's lock
+        self.raw=initialValue
+        self.rawtime=self.clock()
+        self.settledtime=self.rawtime
+        # the counts are read when the metrics are scraped
+        metrics.collect('spyesensor_raw_edges_total',lambda: self.rawEdges,{'pin':sensor})
+        metrics.collect('spyesensor_emitted_edges_total',lambda: self.emittedEdges,{'pin':sensor})
+        if GPIO is not None:
+            GPIO.setmode(GPIO.BCM)
+            GPIO.setwarnings(False)
+            GPIO.setup(self.sensor,GPIO.IN,GPIO.PUD_DOWN)
+            GPIO.add_event_detect(self.sensor,GPIO.BOTH,self.sensorChange)
+
+    # stops reporting the edge counts, for a sensor that is no longer used
+    def unregister(self):
+        metrics.unregister('spyesensor_raw_edges_total',{'pin':self.sensor})
+        metrics.unregister('spyesensor_emitted_edges_total',{'pin':self.sensor})
+
+    def clock(self):
+        if self.scheduler is not None:
+            return self.scheduler.clock()
+        return time.monotonic()
+
+    def sensorChange(self,value):
+        if GPIO is not None and GPIO.input(value):
+            self.edge("On")
+        else:
+            self.edge("Off")
+
+    # takes a raw reading from the pin
+    def edge(self,value):
+        with self.lock:
+            self.rawEdges+=1
+            if value!=self.raw:
+                self.raw=value
+                self.rawtime=self.clock()
+        self.settle()
+
+    # passes the raw reading on if it has settled, otherwise checks again when it could have
+    def settle(self):
+        with self.lock:
+            # back where it started, nothing to pass on
+            if self.raw==self.data:
+                if self.scheduler is not None:
+                    self.scheduler.cancel((self,'settle'))
+                return
+            now=self.clock()
+            wait=0
+            if self.scheduler is not None:
+                wait=max(self.stabletime-(now-self.rawtime),
+                         self.mintime[self.data]-(now-self.settledtime))
+            if wait>0:
+                self.scheduler.schedule((self,'settle'),wait,self.settle)
+                return
+            self.data=self.raw
+            self.emittedEdges+=1
+            self.settledtime=now
+        self._docallbacks()
+
+    # raw edges seen and settled changes passed on
+    def counts(self):
+        return self.rawEdges,self.emittedEdges
@@ -4,170 +4,1001 @@
 ###
 ###############################################################
 
-import socket # for connecting with ip devices
-import chardet
+import asyncio # for talking to the players from one event loop
+import threading # for running the event loop beside the callers
+import codecs # for decoding replies that arrive in chunks
+import os # for the playlist catalog files
 import time
+import inspect # for telling bound methods from other callbacks
+import weakref # for not keeping subscribers alive
+from functools import partial # for binding the verifications
+from spyemetrics import metrics # for the metrics endpoint
+from spyesched import Scheduler # for running the client callbacks off the event loop
 
-# data object
+# data object, safe to use from several threads
+#   bound methods are held weakly so a subscriber can go away without unsubscribing,
+#   other callables are held as they are
+#   setting the value it already has doesn't notify
+#   dispatch runs the notifications elsewhere, e.g. Scheduler.call or an executor's submit,
+#   so a slow subscriber can't hold up the setter, values set while a notification is
+#   waiting are passed on together as the latest value
 class Observable:
-    def __init__(self, initialValue=None):
+    def __init__(self, initialValue=None, dispatch=None):
         self.data = initialValue
         self.callbacks = {}
+        self.lock = threading.RLock()
+        self.dispatch = dispatch
+        self.pending = False
 
     def addCallback(self, func):
-        self.callbacks[func] = 1
+        with self.lock:
+            self.callbacks[callbackKey(func)] = callbackRef(func)
 
     def delCallback(self, func):
-        del self.callback[func]
+        with self.lock:
+            self.callbacks.pop(callbackKey(func), None)
 
+    # notifies the subscribers now, or queues a notification if there isn't one waiting
     def _docallbacks(self):
-        for func in self.callbacks:
-             func(self.data)
+        if self.dispatch is None:
+            self._notify()
+            return
+        with self.lock:
+            if self.pending:
+                return
+            self.pending = True
+        self.dispatch(self._notify)
+
+    def _notify(self):
+        with self.lock:
+            self.pending = False
+            data = self.data
+            callbacks = list(self.callbacks.items())
+        for key, ref in callbacks:
+            func = ref()
+            # the subscriber has gone
+            if func is None:
+                with self.lock:
+                    if self.callbacks.get(key) is ref:
+                        del self.callbacks[key]
+                continue
+            func(data)
 
     def set(self, data):
-        self.data = data
+        with self.lock:
+            if data == self.data:
+                return
+            self.data = data
         self._docallbacks()
 
     def get(self):
         return self.data
 
     def unset(self):
-        self.data = None
+        with self.lock:
+            self.data = None
 
-# spyeworks instance of the observable class
-class Spyeworks(Observable):
-    def __init__(self,ipaddy,filepath,active,idle,initialValue="Offline"):
-        Observable.__init__(self,initialValue)
+# the key a callback is stored under, a bound method is new each time it is looked up
+# so it is known by its object and function
+def callbackKey(func):
+    if inspect.ismethod(func):
+        return (id(func.__self__), func.__func__)
+    return func
+
+# a function returning the callback, or None once the object of a bound method has gone
+def callbackRef(func):
+    if inspect.ismethod(func):
+        return weakref.WeakMethod(func)
+    return lambda: func
+
+# observable list that only notifies when its members change, the change is also
+# set on the delta observable as the names added and removed. It keeps a copy, so a
+# list changed in place by its owner, such as a catalog, is still told apart
+class ListObservable(Observable):
+    def __init__(self, initialValue=None):
+        Observable.__init__(self, None if initialValue is None else list(initialValue))
+        self.delta = Observable()
+
+    def set(self, data):
+        data = list(data)
+        with self.lock:
+            old = self.data
+            self.data = data
+        if old is not None and set(old)==set(data):
+            return
+        old = old or []
+        self.delta.set({'added':[name for name in data if name not in old],
+                        'removed':[name for name in old if name not in data]})
+        self._docallbacks()
+
+# the playlists on a player, kept on disk so they are known at startup
+# the file has the time of the last update on the first line and a playlist per line after
+class Catalog:
+    def __init__(self,ipaddy,cachedir='.'):
+        self.filename=os.path.join(cachedir,'spyecatalog-'+ipaddy.replace(':','-')+'.txt')
+        self.names=None
+        self.updated=0
+        self.load()
+
+    # reads the catalog file if there is one
+    def load(self):
+        try:
+            f=open(self.filename,'r')
+        except:
+            return
+        try:
+            self.updated=float(f.readline())
+            self.names=[line[:-1] for line in f]
+        except ValueError:
+            self.names=None
+        f.close()
+
+    # takes the latest playlists, writing the file if they changed
+    def update(self,names):
+        self.updated=time.time()
+        if names!=self.names:
+            self.names=names
+            self.save()
+
+    # writes a temporary file and renames it so a crash never leaves half a catalog
+    def save(self):
+        try:
+            f=open(self.filename+'.tmp','w')
+            f.write(str(self.updated)+'\n'+''.join(name+'\n' for name in self.names))
+            f.close()
+            os.replace(self.filename+'.tmp',self.filename)
+        except OSError:
+            pass
+
+# an SCP reply is a single line, a DML listing ends with an empty line
+SCP_END=b'\r\n'
+DML_END=b'\r\n\r\n'
+
+# a player that acknowledges SPL answers with a line such as OK, which can't be taken
+# for an SCP reply as those name a .dml playlist
+def isAck(msg):
+    line=msg.strip()
+    return len(line)>0 and not line.lower().endswith('.dml')
+
+# time taken by each step of starting up, for keeping to a startup budget
+class StartupTimes:
+    def __init__(self,started):
+        self.started=started
+        self.last=started
+        self.steps=[]
+
+    # records the time since the last step
+    def step(self,name):
+        now=time.time()
+        self.steps.append((name,now-self.last))
+        self.last=now
+
+    def report(self):
+        return ''.join('%s %.3fs, '%step for step in self.steps)+'total %.3fs'%(self.last-self.started)
+
+# raised when the player refuses the login
+class LoginError(Exception):
+    pass
+
+# raised straight away for commands to a player known to be down
+class PlayerDown(ConnectionError):
+    pass
+
+# the status shown for a failed connection or login
+def errorStatus(error):
+    return "Login Error" if isinstance(error,LoginError) else "Connection Error"
+
+# works out the encoding of some bytes, chardet is slow to import so it is only
+# loaded the first time an encoding has to be detected
+def detectEncoding(data):
+    import chardet
+    return chardet.detect(bytes(data))['encoding'] or 'utf-8'
+
+# decodes replies with an encoding detected once and then cached, chardet only runs
+# again when the cached encoding can't decode a reply
+class ReplyDecoder:
+    def __init__(self):
+        self.encoding=None
+        self.decoder=None
+        self.received=bytearray()
+        self.buffer=[]
+
+    # gets ready for a new reply
+    def start(self):
+        self.decoder=None
+        del self.received[:]
+        self.buffer=[]
+
+    # decodes the next chunk of the reply
+    def feed(self,data):
+        self.received+=data
+        if self.decoder is None:
+            # get the encoding type the first time
+            if self.encoding is None:
+                self.encoding=detectEncoding(data)
+            self.decoder=codecs.getincrementaldecoder(self.encoding)()
+        try:
+            self.buffer.append(self.decoder.decode(data))
+        except UnicodeDecodeError:
+            self.redetect()
+
+    # returns the decoded reply
+    def finish(self):
+        if self.decoder is not None:
+            try:
+                self.buffer.append(self.decoder.decode(b'',True))
+            except UnicodeDecodeError:
+                self.redetect()
+                self.buffer.append(self.decoder.decode(b'',True))
+        return ''.join(self.buffer)
+
+    # the cached encoding was wrong, detect it again from everything received so far
+    def redetect(self):
+        self.encoding=detectEncoding(self.received)
+        self.decoder=codecs.getincrementaldecoder(self.encoding)('replace')
+        self.buffer=[self.decoder.decode(bytes(self.received))]
+
+# event loop running on its own thread, shared by every player in the process
+class EventLoop:
+    instance=None
+    instanceLock=threading.Lock()
+
+    def __init__(self):
+        self.loop=asyncio.new_event_loop()
+        self.thread=threading.Thread(target=self.loop.run_forever,name="spyeworks",daemon=True)
+        self.thread.start()
+
+    # returns the shared loop, starting it on first use
+    @classmethod
+    def get(cls):
+        with cls.instanceLock:
+            if cls.instance is None:
+                cls.instance=EventLoop()
+            return cls.instance
+
+    # schedules a coroutine on the loop from any thread, returns a concurrent future
+    def submit(self,coro):
+        return asyncio.run_coroutine_threadsafe(coro,self.loop)
+
+    # runs a coroutine on the loop and waits for the result
+    def run(self,coro):
+        # waiting on the loop from the loop thread would never finish
+        if threading.current_thread() is self.thread:
+            coro.close()
+            raise RuntimeError("EventLoop.run called from the event loop thread")
+        return self.submit(coro).result()
+
+# the scheduler the client callbacks run on, started on first use. The callbacks run one
+# at a time in the order they were made and never on the event loop, so a subscriber that
+# is slow, raises or calls the blocking API can't hold up the loop or a recovery
+callbacks=None
+callbacksLock=threading.Lock()
+
+def callbackScheduler():
+    global callbacks
+    with callbacksLock:
+        if callbacks is None:
+            callbacks=Scheduler(name="spyeworks-callbacks")
+            callbacks.start()
+        return callbacks
+
+# buffers whatever the player sends on an open connection
+class SpyeworksProtocol(asyncio.Protocol):
+    def __init__(self):
+        self.transport=None
+        self.buffer=bytearray()
+        self.closed=False
+        self.waiter=None
+
+    def connection_made(self,transport):
+        self.transport=transport
+
+    def data_received(self,data):
+        self.buffer+=data
+        self.wake()
+
+    def connection_lost(self,exc):
+        self.closed=True
+        self.wake()
+
+    # releases a reader waiting for data
+    def wake(self):
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
+
+    # waits until there is data or the connection closed, false on timeout
+    async def wait(self,timeout):
+        if self.buffer or self.closed:
+            return True
+        self.waiter=asyncio.get_event_loop().create_future()
+        try:
+            await asyncio.wait_for(self.waiter,timeout)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.waiter=None
+        return True
+
+    # returns and clears the buffered data
+    def take(self):
+        data=bytes(self.buffer)
+        del self.buffer[:]
+        return data
+
+    def write(self,data):
+        self.transport.write(data)
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+
+# splits an address given as host:port, for players on other ports such as the mock player
+def splitAddress(ipaddy,port):
+    host,sep,rest=ipaddy.rpartition(':')
+    if sep and rest.isdigit() and ':' not in host:
+        return host,int(rest)
+    return ipaddy,port
+
+# asyncio client for a single spyeworks player, keeps one logged in connection open
+class AsyncSpyeworks:
+    # once a connection or login fails the player counts as down: commands fail fast,
+    # the latest playlist asked for is kept, and the connection is retried in the
+    # background after backoff seconds, doubling up to maxbackoff. When the player
+    # is back the kept playlist is sent once and the list it is on is read back, then
+    # the player is reported online
+    def __init__(self,ipaddy,port=8900,timeout=5,cachettl=60,backoff=1,maxbackoff=60):
         self.ipaddy=ipaddy
+        self.catalog=Catalog(ipaddy)
+        self.port=port
+        self.timeout=timeout
+        # the playlist last confirmed playing and when, trusted for cachettl seconds
+        self.cachettl=cachettl
+        self.playing=None
+        self.playingtime=0
+        # playlist commands skipped because the list was already playing
+        self.skipped=0
+        # playlist commands sent, a verification stops once a newer one has gone out
+        self.switches=0
+        self.protocol=None
+        self.decoder=ReplyDecoder()
+        # whether the player acknowledges SPL, learnt on each connection from an
+        # acknowledgement read straight after an SPL sent in the same batch
+        self.acks=False
+        # SPLs sent since the last reply was read, the next reply may start with their
+        # acknowledgements
+        self.unacked=0
+        # only one command at a time on the connection, created on the loop
+        self.lock=None
+        # seconds spent on the last connect, login and command
+        self.timings={'connect':0.0,'login':0.0,'command':0.0}
+        # circuit breaker, the recovery task and the playlist to send once the player is back
+        self.backoff=backoff
+        self.maxbackoff=maxbackoff
+        self.down=False
+        self.status="Offline"
+        self.pending=None
+        self.recovery=None
+        # the content folder last used, for reading the list back on recovery
+        self.filepath=None
+        # called on the callback thread with the new status, and with the list read back on recovery
+        self.onStatus=None
+        self.onList=None
+
+    # runs a callback on the callback thread
+    def notify(self,func,value):
+        if func is not None:
+            callbackScheduler().call(func,value)
+
+    # records a status change and passes it on
+    def setStatus(self,status):
+        self.status=status
+        metrics.set('spyeworks_player_down',int(self.down),{'player':self.ipaddy})
+        self.notify(self.onStatus,status)
+
+    # opens the breaker after a failed connection or login and starts the recovery
+    def trip(self,error):
+        if not self.down:
+            self.down=True
+            self.recovery=asyncio.ensure_future(self.recover())
+        self.setStatus(errorStatus(error))
+
+    # retries the connection with backoff until it works, then sends the kept playlist
+    async def recover(self):
+        delay=self.backoff
+        while self.down:
+            await asyncio.sleep(delay)
+            try:
+                async with self.getLock():
+                    if not self.isAlive():
+                        await self.open()
+            except (OSError,asyncio.TimeoutError,LoginError) as error:
+                self.setStatus(errorStatus(error))
+                delay=min(delay*2,self.maxbackoff)
+                continue
+            self.down=False
+        # the kept playlist goes out before anyone hears the player is back
+        pending,self.pending=self.pending,None
+        try:
+            if pending is not None:
+                current=await self.playAndConfirm(*pending)
+            else:
+                current=await self.getCurrentList(self.filepath) if self.filepath is not None else None
+        except (OSError,asyncio.TimeoutError,LoginError):
+            # down again, the next recovery takes over
+            return
+        self.setStatus("Online")
+        if current is not None:
+            self.notify(self.onList,current)
+
+    # opens the connection and logs in
+    async def open(self):
+        loop=asyncio.get_event_loop()
+        # connect, timing how long it takes
+        labels={'player':self.ipaddy}
+        begin=time.time()
+        try:
+            transport,protocol=await asyncio.wait_for(
+                loop.create_connection(SpyeworksProtocol,*splitAddress(self.ipaddy,self.port)),self.timeout)
+        except (OSError,asyncio.TimeoutError):
+            metrics.inc('spyeworks_connection_errors_total',labels)
+            raise
+        self.timings['connect']=time.time()-begin
+        metrics.observe('spyeworks_connect_seconds',self.timings['connect'],labels)
+        # send the login msg and receive the reply
+        begin=time.time()
+        protocol.write(b'LOGIN\r\n')
+        metrics.inc('spyeworks_commands_total',{'player':self.ipaddy,'command':'LOGIN'})
+        if not await protocol.wait(self.timeout):
+            protocol.close()
+            metrics.inc('spyeworks_connection_errors_total',labels)
+            raise asyncio.TimeoutError()
+        msg=protocol.take()
+        self.timings['login']=time.time()-begin
+        metrics.observe('spyeworks_login_seconds',self.timings['login'],labels)
+        # the player may have changed lists while we weren't connected
+        self.forget()
+        # if it's not an OK, login is bad
+        if msg.decode('ascii','replace')[:2]!='OK':
+            protocol.close()
+            metrics.inc('spyeworks_login_errors_total',labels)
+            raise LoginError(msg)
+        self.protocol=protocol
+        # the encoding and whether SPL is acknowledged are worked out again for each connection
+        self.decoder=ReplyDecoder()
+        self.acks=False
+        self.unacked=0
+
+    # closes the connection
+    def close(self):
+        if self.protocol is not None:
+            self.protocol.close()
+            self.protocol=None
+
+    # checks that the open connection is still usable, throwing away any unread replies
+    def isAlive(self):
+        if self.protocol is None:
+            return False
+        if self.protocol.closed:
+            self.protocol=None
+            return False
+        # acknowledgements still waiting are thrown away with the rest
+        self.unacked=max(0,self.unacked-self.protocol.take().count(SCP_END))
+        return True
+
+    # points the client at a different player
+    async def setAddress(self,ipaddy):
+        async with self.getLock():
+            self.close()
+            self.forget()
+            if self.recovery is not None:
+                self.recovery.cancel()
+            self.down=False
+            self.pending=None
+            self.ipaddy=ipaddy
+            self.catalog=Catalog(ipaddy)
+
+    # closes the connection once any command in flight is done
+    async def disconnect(self):
+        async with self.getLock():
+            self.close()
+
+    def getLock(self):
+        if self.lock is None:
+            self.lock=asyncio.Lock()
+        return self.lock
+
+    # sends a command on the open connection, logging in again if the connection died
+    async def command(self,cmd="",reply=False,terminator=None):
+        # login only
+        if len(cmd)==0:
+            if self.down:
+                raise PlayerDown(self.ipaddy)
+            async with self.getLock():
+                await self.connect()
+            return ''
+        return (await self.commands([(cmd,reply,terminator)]))[0]
+
+    # sends a batch of (command, reply, terminator) in one write on the open connection and
+    # reads the replies back in order, returns the reply of each command, '' for those
+    # without one, so e.g. SPL then SCP confirms a switch in about one round trip
+    async def commands(self,batch):
+        if self.down:
+            raise PlayerDown(self.ipaddy)
+        async with self.getLock():
+            for attempt in range(2):
+                # connect and login if there is no usable connection
+                await self.connect()
+                begin=time.time()
+                for cmd,reply,terminator in batch:
+                    metrics.inc('spyeworks_commands_total',{'player':self.ipaddy,'command':cmd[:3]})
+                try:
+                    # send the endcoded commands
+                    self.protocol.write(''.join(cmd for cmd,reply,terminator in batch).encode())
+                    # get the replies there are to parse, each ends where its terminator is
+                    msgs=[]
+                    # an SPL in this batch is waiting for the next reply
+                    spl=False
+                    for cmd,reply,terminator in batch:
+                        if reply:
+                            msg=await self.recv_timeout(terminator)
+                            # the acknowledgements of the SPLs sent before came first
+                            while self.unacked>0 and terminator==SCP_END and isAck(msg):
+                                self.unacked-=1
+                                # only an SPL of this batch teaches that the player acknowledges
+                                if spl:
+                                    self.acks=True
+                                msg=await self.recv_timeout(terminator)
+                            self.unacked=0
+                            spl=False
+                            msgs.append(msg)
+                        else:
+                            if cmd.startswith('SPL'):
+                                self.unacked+=1
+                                spl=True
+                            msgs.append('')
+                    # read the acknowledgements of the last SPLs so they aren't taken for the
+                    # next reply, but only from a player known to send them, and a player that
+                    # stopped sending them isn't waited on again
+                    while self.unacked>0 and self.acks:
+                        self.unacked-=1
+                        if not isAck(await self.recv_timeout(SCP_END)):
+                            self.acks=False
+                except OSError as error:
+                    # the connection went away under us, try once more on a fresh one
+                    self.close()
+                    metrics.inc('spyeworks_connection_errors_total',{'player':self.ipaddy})
+                    if attempt:
+                        self.trip(error)
+                        raise
+                else:
+                    self.timings['command']=time.time()-begin
+                    metrics.observe('spyeworks_command_seconds',self.timings['command'],{'player':self.ipaddy})
+                    return msgs
+
+    # logs in if there is no usable connection, a failure opens the breaker
+    async def connect(self):
+        if self.isAlive():
+            return
+        try:
+            await self.open()
+        except (OSError,asyncio.TimeoutError,LoginError) as error:
+            self.trip(error)
+            raise
+        if self.status!="Online":
+            self.setStatus("Online")
+
+    # routine for receiving a reply from the connection, returns as soon as the terminator
+    # arrives and otherwise stops once nothing more has arrived within the timeout
+    async def recv_timeout(self,terminator=None,timeout=.5):
+        # initiate the variables
+        self.decoder.start()
+        received=bytearray()
+        # if there is no data, wait for twice the timeout
+        wait=timeout*2
+        while await self.protocol.wait(wait):
+            data=self.protocol.take()
+            # the player hung up
+            if not data:
+                if received:
+                    break
+                raise ConnectionResetError("connection closed by player")
+            # look for the end of the reply, including a terminator split across chunks
+            done=False
+            if terminator:
+                start=max(0,len(received)-len(terminator)+1)
+                received+=data
+                end=received.find(terminator,start)
+                if end>=0:
+                    # leave anything after the reply for the next read
+                    extra=len(received)-end-len(terminator)
+                    if extra:
+                        self.protocol.buffer[:0]=data[-extra:]
+                        data=data[:-extra]
+                    done=True
+            else:
+                received+=data
+            # add data to buffer
+            self.decoder.feed(data)
+            if done:
+                break
+            # once there is data, stop when nothing more arrives within the timeout
+            wait=timeout
+        # join the buffer for return
+        return self.decoder.finish()
+
+    # remembers the playlist the player is on
+    def remember(self,filepath,name):
+        self.playing=None if name is None else filepath+name
+        self.playingtime=time.time()
+
+    # forgets the playlist so the next play command is sent
+    def forget(self):
+        self.playing=None
+
+    # checks if the player was recently confirmed to be on the playlist
+    def isPlaying(self,filepath,name):
+        return self.playing==filepath+name and time.time()-self.playingtime<self.cachettl
+
+    # plays a playlist, unless it is already playing and force is off
+    async def playList(self,filepath,name,force=False):
+        self.filepath=filepath
+        if not force and self.isPlaying(filepath,name):
+            self.skipped+=1
+            return name
+        self.switches+=1
+        try:
+            await self.command('SPL'+filepath+name+'.dml\r\n')
+        except:
+            self.forget()
+            # the player is down, send the latest list asked for once it is back
+            if self.down:
+                self.pending=(filepath,name)
+                metrics.inc('spyeworks_deferred_total',{'player':self.ipaddy})
+            raise
+        self.remember(filepath,name)
+        metrics.set('spyeworks_last_playlist_change_seconds',time.time(),{'player':self.ipaddy})
+        return name
+
+    # plays a playlist and reads back what the player is on in the same round trip,
+    # returns the playlist the player confirmed
+    async def playAndConfirm(self,filepath,name):
+        self.filepath=filepath
+        self.switches+=1
+        try:
+            msgs=await self.commands([('SPL'+filepath+name+'.dml\r\n',False,None),
+                                      ('SCP\r\n',True,SCP_END)])
+        except:
+            self.forget()
+            raise
+        current=parseCurrentList(msgs[1],filepath)
+        self.remember(filepath,current)
+        if current==name:
+            metrics.set('spyeworks_last_playlist_change_seconds',time.time(),{'player':self.ipaddy})
+        return current
+
+    # reads back the playlist after a switch until the player reports the one expected,
+    # waiting delay, then twice that and so on between tries, returns what the player
+    # is on, or None if a newer switch went out or the player couldn't be reached
+    async def verify(self,filepath,name,retries=3,delay=.25):
+        switch=self.switches
+        current=None
+        for attempt in range(retries):
+            await asyncio.sleep(delay*2**attempt)
+            if self.switches!=switch:
+                return None
+            try:
+                current=await self.getCurrentList(filepath)
+            except (OSError,asyncio.TimeoutError,LoginError):
+                continue
+            if self.switches!=switch:
+                return None
+            if current==name:
+                return current
+        if current is not None:
+            metrics.inc('spyeworks_verify_mismatches_total',{'player':self.ipaddy})
+        return current
+
+    # gets the playlist currently playing
+    async def getCurrentList(self,filepath):
+        self.filepath=filepath
+        try:
+            current=parseCurrentList(await self.command('SCP\r\n',True,SCP_END),filepath)
+        except:
+            self.forget()
+            raise
+        self.remember(filepath,current)
+        return current
+
+    # gets all the playlists on the player and updates the catalog
+    async def getAllPlaylists(self,filepath):
+        allLists=parseAllLists(await self.command('DML\r\n',True,DML_END),filepath)
+        self.catalog.update(allLists)
+        return allLists
+
+# gets the current list from an SCP reply
+def parseCurrentList(msg,filepath):
+    current=None
+    # loop over strings
+    for st in msg.split('\r\n'):
+        # get the playlist response
+        myString=st[len(filepath):-4]
+        # if there is a response
+        if len(myString)>0:
+            # assign response to current list
+            current=myString
+    return current
+
+# gets the list names from a DML reply
+def parseAllLists(msg,filepath):
+    allListsTemp=[]
+    # loop over strings
+    for st in msg.split('\r\n'):
+        myString=st[len(filepath):-12]
+        if len(myString)>0:
+            # add response to list
+            allListsTemp.append(myString)
+    return allListsTemp
+
+# the lists found in every one of the lists, in the order of the first
+def commonLists(lists):
+    common=set(lists[0]).intersection(*lists[1:])
+    return [name for name in lists[0] if name in common]
+
+# what a single player and a group of players have in common: the settings, the current
+# list, playlists and mismatch observables, and the read back of each switch
+class SpyeworksBase(Observable):
+    def __init__(self,filepath,active,idle,initialValue="Offline",loop=None):
+        Observable.__init__(self,initialValue)
         self.port=8900
+        self.loop=loop if loop is not None else EventLoop.get()
         self.filepath=filepath
         self.active=active
         self.idle=idle
         self.activeplaying=False
         self.idleplaying=False
-        self.parse=False
         self.currentList=Observable()
-        self.allLists=Observable()
-        self.login()
+        # switches are read back in the background, a player found on a different list
+        # than expected is reported here as {'player','expected','actual','time'}
+        self.verifying=True
+        self.mismatch=Observable()
+        self.allLists=ListObservable()
 
-    def login(self,cmd=""):
-        # initiate the socket
-        s=socket.socket(socket.AF_INET,socket.SOCK_STREAM)
-        # set the socket connect timeout
-        s.settimeout(5)
-        # try to connect
+    # the players are on this list
+    def setCurrent(self,current):
+        self.currentList.set(current)
+        self.activeplaying=current==self.active
+        self.idleplaying=current==self.idle
+
+    # plays the active list, force sends the command even if the list is already playing,
+    # returns False if no command went out
+    def playActive(self,force=False):
+        return self.play(self.active,force)
+
+    # plays the idle list, force sends the command even if the list is already playing,
+    # returns False if no command went out
+    def playIdle(self,force=False):
+        return self.play(self.idle,force)
+
+    # reads the list back from a player on the event loop without waiting for it,
+    # correcting the current list if the player didn't switch. The correction runs on
+    # the callback thread, as the subscribers must never run on the event loop
+    def verifySwitch(self,client,name):
+        if self.verifying:
+            self.loop.submit(client.verify(self.filepath,name)).add_done_callback(
+                partial(callbackScheduler().call,self.verified,client,name))
+
+    def verified(self,client,name,future):
+        if future.cancelled() or future.exception() is not None:
+            return
+        current=future.result()
+        if current is None or current==name:
+            return
+        self.setCurrent(current)
+        self.mismatch.set({'player':client.ipaddy,'expected':name,'actual':current,'time':time.time()})
+
+    # a player came back and is on this list
+    def recovered(self,current):
+        self.setCurrent(current)
+
+# spyeworks instance of the observable class, a blocking wrapper around AsyncSpyeworks
+# that can be used from any thread
+# probe gets the current list before returning, without it call getCurrentList when ready
+class Spyeworks(SpyeworksBase):
+    def __init__(self,ipaddy,filepath,active,idle,initialValue="Offline",loop=None,probe=True):
+        SpyeworksBase.__init__(self,filepath,active,idle,initialValue,loop)
+        self.client=AsyncSpyeworks(ipaddy,self.port)
+        # the client reports a player going down and coming back as it happens
+        self.client.onStatus=self.set
+        self.client.onList=self.recovered
+        # the playlists on the player, starting with the ones cached from the last run
+        self.allLists=ListObservable(self.client.catalog.names)
+        # a copy, the client updates its timings in place so the live dict would always
+        # compare equal to the last value and never notify
+        self.timings=Observable(dict(self.client.timings))
+        if probe:
+            self.getCurrentList()
+
+    # the player address lives on the client, changing it drops the open connection
+    @property
+    def ipaddy(self):
+        return self.client.ipaddy
+
+    @ipaddy.setter
+    def ipaddy(self,value):
+        self.loop.run(self.client.setAddress(value))
+
+    # runs a client coroutine on the event loop and updates the player status
+    def run(self,coro):
         try:
-            s.connect((self.ipaddy,self.port))
+            result=self.loop.run(coro)
+        # the player is known to be down, the client has already set the status
+        except PlayerDown:
+            pass
+        # login not okay
+        except LoginError:
+            # set the device to login error
+            self.set("Login Error")
         # connection error
-        except:
+        except (OSError,asyncio.TimeoutError):
             self.set("Connection Error")
-        # socket connected
         else:
-            # send the login msg
-            s.send(b'LOGIN\r\n')
-            # receive the reply
-            msg=s.recv(1024)
-            # decode the reply
-            msg=msg.decode('ascii')
-            # if it's an OK, login is good
-            if(msg[:2]=='OK'):
-                # set device to Online
-                self.set("Online")
-                # if there is a command
-                if len(cmd)>0:
-                    # send the endcoded command
-                    s.send(cmd.encode())
-                    # if the command needs to be parsed
-                    if self.parse:
-                        # reset the parse flag
-                        self.parse=False
-                        # get the strings for parsing
-                        stringsForParsing=self.recv_timeout(s).split('\r\n')
-                        # if we are pasring an all playlists response
-                        if self.parseType=='all':
-                            allListsTemp=[]
-                            # loop over strings
-                            for st in stringsForParsing:
-                                myString=st[len(self.filepath):-12]
-                                if len(myString)>0:
-                                    # add response to list
-                                    allListsTemp.append(myString)
-                            self.allLists.set(allListsTemp)
-                        # if we are parsing the current list
-                        elif self.parseType=='current':
-                            # loop over strings
-                            for st in stringsForParsing:
-                                # get the playlist response
-                                myString=st[len(self.filepath):-4]
-                                # if there is a response
-                                #if len(myString)>0:
-                                    # assign response to current list
-                                self.currentList.set(myString)
-            # login not okay         
-            else:
-                # set the device to login error
-                self.set("Login Error")
-            # close the socket connection
-            s.close()
-
-    # routine for receiving chunks of data from a socket
-    def recv_timeout(self,mySocket,timeout=.25):
-        # set the socket to nonblocking
-        mySocket.setblocking(0)
-        # initiate the variables
-        buffer=[]
-        data=''
-        begin=time.time()
-        # start the while loop
-        while 1:
-            # if there is data and we've reached the timeout, end the while
-            if buffer and time.time()-begin > timeout:
-                break
-            # if there is no data, wait for twice the timeout
-            elif time.time()-begin > timeout*2:
-                break
-            
-            # receive data
+            # set device to Online
+            self.set("Online")
+            # report how long the connection took
+            self.timings.set(dict(self.client.timings))
+            return result
+        return None
+
+    # logs in and sends a command without parsing the reply
+    def login(self,cmd=""):
+        self.run(self.client.command(cmd))
+
+    # closes the open player connection
+    def close(self):
+        self.loop.submit(self.client.disconnect())
+
+    def getCurrentList(self):
+        current=self.run(self.client.getCurrentList(self.filepath))
+        if current is not None:
+            self.currentList.set(current)
+
+    def getAllPlaylists(self):
+        allLists=self.run(self.client.getAllPlaylists(self.filepath))
+        if allLists is not None:
+            self.allLists.set(allLists)
+
+    # plays a list, force sends the command even if the list is already playing,
+    # returns whether a command went out
+    def play(self,name,force=False):
+        switches=self.client.switches
+        if self.run(self.client.playList(self.filepath,name,force)) is not None:
+            self.setCurrent(name)
+            if self.client.switches!=switches:
+                self.verifySwitch(self.client,name)
+        return self.client.switches!=switches
+
+    # plays a list and returns the list the player confirmed it is on, None if it couldn't be reached
+    def playAndConfirm(self,name):
+        current=self.run(self.client.playAndConfirm(self.filepath,name))
+        if current is not None:
+            self.setCurrent(current)
+        return current
+
+# a group of players that switch together, with the same interface as Spyeworks
+class SpyeworksFleet(SpyeworksBase):
+    def __init__(self,ipaddys,filepath,active,idle,initialValue="Offline",loop=None,probe=True):
+        SpyeworksBase.__init__(self,filepath,active,idle,initialValue,loop)
+        self.clients=[]
+        # status and seconds taken by each player on the last command
+        self.results=Observable({})
+        # connect, login and command timings of each player
+        self.timings=Observable({})
+        self.ipaddy=ipaddys
+        # start with the playlists cached from the last run
+        catalogs=[client.catalog.names for client in self.clients]
+        if len(catalogs)>0 and None not in catalogs:
+            self.allLists.set(commonLists(catalogs))
+        if probe:
+            self.getCurrentList()
+
+    # the player addresses as a comma separated string
+    @property
+    def ipaddy(self):
+        return ','.join(client.ipaddy for client in self.clients)
+
+    # keeps the open connections of players still in the list and drops the rest
+    @ipaddy.setter
+    def ipaddy(self,value):
+        if isinstance(value,str):
+            value=value.split(',')
+        current=dict((client.ipaddy,client) for client in self.clients)
+        clients=[]
+        for ipaddy in value:
+            ipaddy=ipaddy.strip()
+            if len(ipaddy)>0:
+                client=current.pop(ipaddy,None)
+                if client is None:
+                    client=AsyncSpyeworks(ipaddy,self.port)
+                    # players going down and coming back are reported as it happens
+                    client.onStatus=lambda status: self.summarize()
+                    client.onList=self.recovered
+                clients.append(client)
+        for client in current.values():
+            self.loop.submit(client.disconnect())
+        self.clients=clients
+
+    # runs a command on every player at once, returns (ipaddy,status,result,seconds) for each
+    async def fanOut(self,func):
+        async def timed(client):
+            begin=time.time()
             try:
-                data=mySocket.recv(8192)
-            except:
-                pass
-            else:
-                # if data received
-                if data:
-                    # get the encoding type
-                    encoding=chardet.detect(data)['encoding']
-                    # add data to buffer
-                    buffer.append(data.decode(encoding))
-                    # reset timeout
-                    begin=time.time()
+                result=await func(client)
+            except PlayerDown:
+                return client.ipaddy,client.status,None,time.time()-begin
+            except LoginError:
+                return client.ipaddy,"Login Error",None,time.time()-begin
+            except (OSError,asyncio.TimeoutError):
+                return client.ipaddy,"Connection Error",None,time.time()-begin
+            return client.ipaddy,"Online",result,time.time()-begin
+        return await asyncio.gather(*[timed(client) for client in self.clients])
 
-        # join the buffer for return
-        return ''.join(buffer)
+    # runs a command on every player and updates the status, returns the results of the players online
+    def run(self,func):
+        results=self.loop.run(self.fanOut(func))
+        self.results.set(dict((ipaddy,(status,seconds)) for ipaddy,status,result,seconds in results))
+        self.timings.set(dict((client.ipaddy,dict(client.timings)) for client in self.clients))
+        self.summarize()
+        return [result for ipaddy,status,result,seconds in results if status=="Online"]
+
+    # all players agree, or count the ones online
+    def summarize(self):
+        statuses=[client.status for client in self.clients]
+        if len(set(statuses))==1:
+            self.set(statuses[0])
+        elif len(statuses)>1:
+            self.set("%d of %d Online"%(statuses.count("Online"),len(statuses)))
+
+    # closes the open player connections
+    def close(self):
+        for client in self.clients:
+            self.loop.submit(client.disconnect())
 
     def getCurrentList(self):
-        self.parse=True
-        self.parseType='current'
-        self.login('SCP\r\n')
+        for current in self.run(lambda client: client.getCurrentList(self.filepath)):
+            if current is not None:
+                self.currentList.set(current)
+                break
 
+    # only the lists every player has can be played on all of them
     def getAllPlaylists(self):
-        self.parse=True
-        self.parseType='all'
-        self.login('DML\r\n')
-
-    def playActive(self):
-        self.login('SPL'+self.filepath+self.active+'.dml\r\n')
-        print("Play Active")
-        #self.currentlist=self.active
-        self.activeplaying=True
-        self.idleplaying=False
+        results=self.run(lambda client: client.getAllPlaylists(self.filepath))
+        if len(results)>0:
+            self.allLists.set(commonLists(results))
 
-    def playIdle(self):
-        self.login('SPL'+self.filepath+self.idle+'.dml\r\n')
-        print("Play Idle")
-        #self.currentlist=self.idle
-        self.activeplaying=False
-        self.idleplaying=True
+    # plays a list on every player, force sends the command even if the list is already
+    # playing, and reads it back from each player the command went to, returns whether a
+    # command went out to any player
+    def play(self,name,force=False):
+        clients=list(self.clients)
+        switches=[client.switches for client in clients]
+        if len(self.run(lambda client: client.playList(self.filepath,name,force)))>0:
+            self.setCurrent(name)
+            for client,before in zip(clients,switches):
+                if client.switches!=before:
+                    self.verifySwitch(client,name)
+        return any(client.switches!=before for client,before in zip(clients,switches))
+
+    # plays a list on every player and reads back what each is on, returns the list if every
+    # player online confirmed it, otherwise None
+    def playAndConfirm(self,name):
+        results=self.run(lambda client: client.playAndConfirm(self.filepath,name))
+        for current in results:
+            if current is not None:
+                self.setCurrent(current)
+                break
+        if len(results)>0 and all(current==name for current in results):
+            return name
+        return None
 
 def updatePlayerOnline(value):
     print(value)
@@ -178,11 +1009,11 @@ def updateCurrentList(value):
 def updateAllLists(value):
     print(value)
 
+if __name__ == '__main__':
+    spyeworks = Spyeworks("10.10.9.51",
+                        "c:/users/public/documents/spyeworks/content/",
+                        "code 42","jamf")
 
-spyeworks = Spyeworks("10.10.9.51",
-                    "c:/users/public/documents/spyeworks/content/",
-                    "code 42","jamf")
-
-spyeworks.addCallback(updatePlayerOnline)
-spyeworks.currentList.addCallback(updateCurrentList)
-spyeworks.allLists.addCallback(updateAllLists)
+    spyeworks.addCallback(updatePlayerOnline)
+    spyeworks.currentList.addCallback(updateCurrentList)
+    spyeworks.allLists.addCallback(updateAllLists)
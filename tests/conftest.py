@@ -0,0 +1,29 @@
+###############################################################
+###
+###   Test setup, the scripts are imported from the folder above
+###
+###############################################################
+
+import os
+import sys
+import types
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# off a Raspberry Pi there is no RPi.GPIO, the tests stand in for the sensor pins
+# with one that never sees an edge
+try:
+    import RPi.GPIO
+except ImportError:
+    GPIO=types.ModuleType('RPi.GPIO')
+    GPIO.BCM=11
+    GPIO.IN=1
+    GPIO.PUD_DOWN=21
+    GPIO.BOTH=33
+    for name in ('setmode','setwarnings','setup','add_event_detect','remove_event_detect','cleanup'):
+        setattr(GPIO,name,lambda *args,**kwargs: None)
+    GPIO.input=lambda pin: 0
+    RPi=types.ModuleType('RPi')
+    RPi.GPIO=GPIO
+    sys.modules['RPi']=RPi
+    sys.modules['RPi.GPIO']=GPIO
@@ -0,0 +1,140 @@
+###############################################################
+###
+###   Tests for reading the config file and the routing table
+###
+###############################################################
+
+import os
+import pytest
+from spyesched import Scheduler
+from spyeconfig import DEFAULTS, KEYS, formatConfig, loadConfig, ConfigFile
+import spyepir
+
+class ManualClock:
+    def __init__(self):
+        self.now=0.0
+
+    def __call__(self):
+        return self.now
+
+# the config file and the player catalogs go in a folder of their own
+@pytest.fixture
+def folder(tmp_path,monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+def writeConfig(folder,routes,**values):
+    (folder/'spyeconfig.txt').write_text(formatConfig(dict(DEFAULTS,**values),routes))
+
+def test_keyed_file_round_trip(folder):
+    values=dict(DEFAULTS,active="code 42",idle="jamf")
+    writeConfig(folder,['14|127.0.0.1:1'],active="code 42",idle="jamf")
+    assert loadConfig('spyeconfig.txt')==(values,['14|127.0.0.1:1'],True)
+
+def test_missing_file_is_the_defaults(folder):
+    assert loadConfig('spyeconfig.txt')==(DEFAULTS,[],False)
+
+# one setting a line in the order of the first nine keys, then the routes
+def test_legacy_file(folder):
+    lines=["10.10.9.51","c:/content/","code 42","jamf","T","F","30","T","10","14|127.0.0.1:1"]
+    (folder/'spyeconfig.txt').write_text('\n'.join(lines)+'\n')
+    values,routes,current=loadConfig('spyeconfig.txt')
+    assert [values[key] for key in KEYS[:9]]==lines[:9]
+    assert values['commandrate']==DEFAULTS['commandrate']
+    assert routes==['14|127.0.0.1:1']
+    assert not current
+
+# the eight lines spyepirtest.py writes, without the sensor setting
+def test_spyepirtest_file(folder):
+    (folder/'spyeconfig.txt').write_text('192.168.1.110\nc:/content/\nactive\nidle\nF\n0\nT\n10\n')
+    values,routes,current=loadConfig('spyeconfig.txt')
+    assert values['activelist']=="F"
+    assert values['activedelaytime']=="0"
+    assert values['idlelist']=="T"
+    assert values['idledelaytime']=="10"
+    assert values['sensorenable']==DEFAULTS['sensorenable']
+    assert routes==[]
+    assert not current
+
+# the file is written to a temporary file that is renamed over it, and only when it changed
+def test_write_is_atomic(folder,monkeypatch):
+    values=dict(DEFAULTS)
+    config=ConfigFile('spyeconfig.txt',lambda: (values,[]))
+    replaced=[]
+    replace=os.replace
+    def recordReplace(source,target):
+        replaced.append((source,target,open(source).read()))
+        replace(source,target)
+    monkeypatch.setattr(os,'replace',recordReplace)
+    config.save()
+    config.save()
+    assert replaced==[('spyeconfig.txt.tmp','spyeconfig.txt',formatConfig(values,[]))]
+    assert not os.path.exists('spyeconfig.txt.tmp')
+    assert config.writes==1
+
+# changes close together are written once, after they stop coming
+def test_writes_are_batched(folder):
+    clock=ManualClock()
+    scheduler=Scheduler(clock)
+    values=dict(DEFAULTS)
+    config=ConfigFile('spyeconfig.txt',lambda: (values,[]),scheduler)
+    for active in ("a","b","c"):
+        values['active']=active
+        config.save()
+        clock.now+=.5
+        scheduler.runPending()
+    assert config.writes==0
+    clock.now+=1
+    scheduler.runPending()
+    assert config.writes==1
+    assert loadConfig('spyeconfig.txt')[0]['active']=="c"
+
+# bad lines are reported and left out at startup rather than stopping the daemon, and
+# kept in the file so they can be put right
+def test_startup_skips_bad_routes_and_delays(folder,capsys):
+    routes=['abc|','15|127.0.0.1:2','15|127.0.0.1:3','16|127.0.0.1:4||||x']
+    writeConfig(folder,routes,idledelaytime='x')
+    model=spyepir.Model(Scheduler(ManualClock()))
+    assert [zone.pin for zone in model.zones]==[15]
+    assert model.zones[0].spyeworks.ipaddy=='127.0.0.1:2'
+    assert model.idledelaytime.get()==DEFAULTS['idledelaytime']
+    assert model.routes==routes
+    printed=capsys.readouterr().out
+    assert "route 'abc|'" in printed
+    assert "pin 15 has more than one route" in printed
+    assert "route '16|127.0.0.1:4||||x'" in printed
+    assert "idledelaytime 'x'" in printed
+
+def test_startup_without_a_usable_route_uses_pin_14(folder):
+    writeConfig(folder,['abc|'])
+    model=spyepir.Model(Scheduler(ManualClock()))
+    assert [zone.pin for zone in model.zones]==[14]
+
+# only the settings and zones that changed are applied, the zones kept are the same objects
+def test_reload_applies_what_changed(folder):
+    writeConfig(folder,['14|127.0.0.1:1','15|127.0.0.1:2'])
+    model=spyepir.Model(Scheduler(ManualClock()))
+    zone14,zone15=model.zones
+    writeConfig(folder,['14|127.0.0.1:1|special','16|127.0.0.1:3'],idle="jamf")
+    changed,added,removed=model.reload()
+    assert changed==['idle']
+    assert [zone.pin for zone in added]==[16]
+    assert removed==[zone15]
+    assert model.zones[0] is zone14
+    assert zone14.active=="special"
+    assert zone14.spyeworks.idle=="jamf"
+    assert model.spyeworks is zone14.spyeworks
+    assert model.reload()==([],[],[])
+
+# a file with a bad line changes nothing
+@pytest.mark.parametrize('routes,values',[(['abc|'],{}),(['14|127.0.0.1:1','14|127.0.0.1:2'],{}),
+                                          (['14|127.0.0.1:1'],{'activedelaytime':'soon'})])
+def test_reload_refuses_a_bad_file(folder,routes,values):
+    writeConfig(folder,['14|127.0.0.1:1'])
+    model=spyepir.Model(Scheduler(ManualClock()))
+    zones=list(model.zones)
+    writeConfig(folder,routes,active="changed",**values)
+    with pytest.raises(ValueError):
+        model.reload()
+    assert model.zones==zones
+    assert model.active.get()==DEFAULTS['active']
@@ -0,0 +1,164 @@
+###############################################################
+###
+###   Tests for the active and idle delay timers of spyepir.py
+###   and spyepirGUI.py, run on a clock moved on by hand so
+###   minutes of delays are checked in no time
+###
+###############################################################
+
+import types
+import pytest
+from spyesched import Scheduler, LatestQueue
+from spyeworks import Observable
+import spyepir
+
+class ManualClock:
+    def __init__(self):
+        self.now=0.0
+
+    def __call__(self):
+        return self.now
+
+# moves the clock on to until, running each call on the schedulers when it is due
+def runUntil(clock,schedulers,until):
+    while True:
+        waits=[wait for wait in (scheduler.runPending() for scheduler in schedulers) if wait is not None]
+        if len(waits)==0 or clock.now+min(waits)>until:
+            clock.now=until
+            for scheduler in schedulers:
+                scheduler.runPending()
+            return
+        clock.now+=min(waits)
+
+# stands in for the players, records the lists played and when, a list already
+# playing isn't sent again and the call returns False
+class FakePlayers:
+    def __init__(self,clock,current="idle"):
+        self.clock=clock
+        self.active="active"
+        self.idle="idle"
+        self.currentList=Observable(current)
+        self.played=[]
+
+    def playActive(self):
+        return self.play(self.active)
+
+    def playIdle(self):
+        return self.play(self.idle)
+
+    def play(self,name):
+        if self.currentList.get()==name:
+            return False
+        self.played.append((self.clock(),name))
+        self.currentList.set(name)
+        return True
+
+# the console controller with one zone, without the sensors, players and config file
+def consoleController(idledelaytime="10",idlelist="T",dwell=0):
+    clock=ManualClock()
+    controller=spyepir.Controller.__new__(spyepir.Controller)
+    controller.scheduler=Scheduler(clock)
+    controller.worker=Scheduler(clock)
+    controller.model=types.SimpleNamespace(idlelist=Observable(idlelist))
+    zone=spyepir.Zone("14")
+    zone.idle="idle"
+    zone.idledelaytime=idledelaytime
+    zone.spyeworks=FakePlayers(clock)
+    zone.queue=LatestQueue(controller.worker,"zone 14",dwell=dwell)
+    return clock,controller,zone
+
+def sense(clock,controller,zone,events,until):
+    for when,value in events:
+        runUntil(clock,(controller.scheduler,controller.worker),when)
+        controller.updateSensorState(zone,value)
+    runUntil(clock,(controller.scheduler,controller.worker),until)
+    return zone.spyeworks.played
+
+def test_console_motion_plays_active_straight_away():
+    clock,controller,zone=consoleController()
+    assert sense(clock,controller,zone,[(0,"On")],1)==[(0,"active")]
+
+def test_console_idle_after_the_idle_delay():
+    clock,controller,zone=consoleController()
+    played=sense(clock,controller,zone,[(0,"On"),(5,"Off")],14.9)
+    assert played==[(0,"active")]
+    runUntil(clock,(controller.scheduler,controller.worker),20)
+    assert played==[(0,"active"),(15,"idle")]
+
+def test_console_motion_during_the_idle_delay_keeps_active():
+    clock,controller,zone=consoleController()
+    played=sense(clock,controller,zone,[(0,"On"),(5,"Off"),(12,"On")],60)
+    assert played==[(0,"active")]
+
+def test_console_idle_delay_restarts_on_each_off():
+    clock,controller,zone=consoleController()
+    played=sense(clock,controller,zone,[(0,"On"),(5,"Off"),(12,"On"),(13,"Off")],60)
+    assert played==[(0,"active"),(23,"idle")]
+
+# motion while the active list is already up sends nothing, so it doesn't restart the dwell
+def test_console_dwell_runs_from_the_last_real_change():
+    clock,controller,zone=consoleController(dwell=30)
+    played=sense(clock,controller,zone,[(0,"On"),(35,"Off"),(40,"On"),(41,"Off")],100)
+    assert played==[(0,"active"),(51,"idle")]
+
+def test_console_idle_list_off():
+    clock,controller,zone=consoleController(idlelist="F")
+    played=sense(clock,controller,zone,[(0,"On"),(5,"Off")],60)
+    assert played==[(0,"active")]
+
+# the gui controller, without the window, the player connection and the config file
+def guiController(activedelaytime="30",idledelaytime="10",sensorenable="T",activelist="T",idlelist="T"):
+    spyepirGUI=pytest.importorskip("spyepirGUI")
+    clock=ManualClock()
+    controller=spyepirGUI.Controller.__new__(spyepirGUI.Controller)
+    controller.scheduler=Scheduler(clock)
+    controller.worker=Scheduler(clock)
+    controller.uiqueue=spyepirGUI.queue.Queue()
+    controller.view=types.SimpleNamespace(updateSensor=lambda value: None)
+    controller.model=types.SimpleNamespace(sensorenable=Observable(sensorenable),activelist=Observable(activelist),
+                                           activedelaytime=Observable(activedelaytime),idlelist=Observable(idlelist),
+                                           idledelaytime=Observable(idledelaytime),sensorstate=Observable("Off"),
+                                           spyeworks=FakePlayers(clock))
+    controller.switches=LatestQueue(controller.worker,"gui")
+    controller.playIdleList=False
+    return clock,controller
+
+def senseGUI(clock,controller,events,until):
+    for when,value in events:
+        runUntil(clock,(controller.scheduler,controller.worker),when)
+        controller.model.sensorstate.set(value)
+        controller.updateSensorState(value)
+    runUntil(clock,(controller.scheduler,controller.worker),until)
+    return controller.model.spyeworks.played
+
+def test_gui_idle_waits_for_the_active_delay():
+    clock,controller=guiController()
+    played=senseGUI(clock,controller,[(0,"On"),(5,"Off")],39.9)
+    assert played==[(0,"active")]
+    runUntil(clock,(controller.scheduler,controller.worker),60)
+    assert played==[(0,"active"),(40,"idle")]
+
+def test_gui_motion_restarts_the_active_delay():
+    clock,controller=guiController()
+    played=senseGUI(clock,controller,[(0,"On"),(5,"Off"),(20,"On"),(25,"Off")],100)
+    assert played==[(0,"active"),(60,"idle")]
+
+def test_gui_without_the_active_delay():
+    clock,controller=guiController(activelist="F")
+    played=senseGUI(clock,controller,[(0,"On"),(5,"Off")],100)
+    assert played==[(0,"active"),(15,"idle")]
+
+def test_gui_sensor_disabled():
+    clock,controller=guiController(sensorenable="F")
+    played=senseGUI(clock,controller,[(0,"On"),(5,"Off")],100)
+    assert played==[]
+
+# motion back before the idle list has gone out to the players still ends on the active list
+def test_console_motion_back_before_the_idle_list_is_sent():
+    clock,controller,zone=consoleController(idledelaytime="0")
+    zone.spyeworks.currentList.set("active")
+    for value in ("On","Off","On"):
+        controller.updateSensorState(zone,value)
+        controller.scheduler.runPending()
+    runUntil(clock,(controller.scheduler,controller.worker),10)
+    assert zone.spyeworks.currentList.get()=="active"
@@ -0,0 +1,83 @@
+###############################################################
+###
+###   Tests for the observables the scripts share their state through
+###
+###############################################################
+
+import gc
+from spyeworks import Observable, ListObservable
+
+class Subscriber:
+    def __init__(self):
+        self.values=[]
+
+    def update(self,value):
+        self.values.append(value)
+
+def test_notifies_only_on_change():
+    observable=Observable("Offline")
+    subscriber=Subscriber()
+    observable.addCallback(subscriber.update)
+    for value in ("Online","Online","Connection Error","Online"):
+        observable.set(value)
+    assert subscriber.values==["Online","Connection Error","Online"]
+
+def test_a_bound_method_is_held_weakly():
+    observable=Observable()
+    subscriber=Subscriber()
+    observable.addCallback(subscriber.update)
+    observable.set(1)
+    values=subscriber.values
+    del subscriber
+    gc.collect()
+    observable.set(2)
+    assert values==[1]
+    assert len(observable.callbacks)==0
+
+# a bound method is a new object each time it is looked up, it is still found to remove
+def test_del_callback():
+    observable=Observable()
+    subscriber=Subscriber()
+    calls=[]
+    observable.addCallback(subscriber.update)
+    observable.addCallback(calls.append)
+    observable.delCallback(subscriber.update)
+    observable.delCallback(calls.append)
+    observable.set(1)
+    assert subscriber.values==[]
+    assert calls==[]
+
+# values set while a notification is waiting are passed on together as the latest
+def test_dispatch_coalesces_to_the_latest_value():
+    dispatched=[]
+    observable=Observable(0,dispatch=dispatched.append)
+    subscriber=Subscriber()
+    observable.addCallback(subscriber.update)
+    for value in (1,2,3):
+        observable.set(value)
+    assert subscriber.values==[]
+    assert len(dispatched)==1
+    dispatched.pop()()
+    assert subscriber.values==[3]
+    observable.set(4)
+    assert len(dispatched)==1
+
+def test_list_notifies_when_the_members_change():
+    lists=ListObservable(["a","b"])
+    subscriber=Subscriber()
+    lists.addCallback(subscriber.update)
+    lists.delta.addCallback(subscriber.update)
+    lists.set(["b","a"])
+    assert subscriber.values==[]
+    lists.set(["b","c"])
+    assert subscriber.values==[{'added':["c"],'removed':["a"]},["b","c"]]
+
+# a list changed in place by its owner is still told apart from the one held
+def test_list_keeps_a_copy():
+    names=["a"]
+    lists=ListObservable(names)
+    subscriber=Subscriber()
+    lists.addCallback(subscriber.update)
+    names.append("b")
+    lists.set(names)
+    assert subscriber.values==[["a","b"]]
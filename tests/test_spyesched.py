@@ -0,0 +1,156 @@
+###############################################################
+###
+###   Tests for the scheduler
+###
+###############################################################
+
+import threading
+import time
+from spyesched import Scheduler, ScaledClock, LatestQueue
+
+# a clock that only moves when the test moves it
+class ManualClock:
+    def __init__(self):
+        self.now=0.0
+
+    def __call__(self):
+        return self.now
+
+def test_runs_calls_at_their_deadlines():
+    clock=ManualClock()
+    scheduler=Scheduler(clock)
+    calls=[]
+    scheduler.schedule('late',10,calls.append,'late')
+    scheduler.schedule('soon',5,calls.append,'soon')
+    assert scheduler.runPending()==5
+    assert calls==[]
+    clock.now=5
+    assert scheduler.runPending()==5
+    assert calls==['soon']
+    clock.now=10
+    assert scheduler.runPending() is None
+    assert calls==['soon','late']
+
+def test_key_replaces_and_cancels():
+    clock=ManualClock()
+    scheduler=Scheduler(clock)
+    calls=[]
+    scheduler.schedule('idle',10,calls.append,'first')
+    clock.now=5
+    scheduler.schedule('idle',10,calls.append,'second')
+    assert scheduler.count()==1
+    clock.now=10
+    scheduler.runPending()
+    assert calls==[]
+    clock.now=15
+    scheduler.runPending()
+    assert calls==['second']
+    scheduler.schedule('idle',10,calls.append,'third')
+    scheduler.cancel('idle')
+    assert not scheduler.pending('idle')
+    clock.now=30
+    scheduler.runPending()
+    assert calls==['second']
+
+def test_calls_run_in_the_order_queued():
+    scheduler=Scheduler(ManualClock())
+    calls=[]
+    for number in range(5):
+        scheduler.call(calls.append,number)
+    scheduler.runPending()
+    assert calls==[0,1,2,3,4]
+
+def test_failing_call_does_not_stop_the_rest():
+    scheduler=Scheduler(ManualClock())
+    calls=[]
+    scheduler.call(lambda: 1/0)
+    scheduler.call(calls.append,'after')
+    scheduler.runPending()
+    assert calls==['after']
+
+def test_scaled_clock_runs_fast():
+    clock=ScaledClock(1000)
+    begin=time.monotonic()
+    time.sleep(0.01)
+    assert clock()-clock.started>=10
+    assert time.monotonic()-begin<1
+
+# a 10 second delay on the scheduler thread at 1000x is done in about 10 ms
+def test_speed_runs_the_thread_on_a_scaled_clock():
+    scheduler=Scheduler(speed=1000)
+    scheduler.start()
+    fired=threading.Event()
+    begin=time.monotonic()
+    scheduler.schedule('idle',10,fired.set)
+    try:
+        assert fired.wait(2)
+        assert time.monotonic()-begin<2
+    finally:
+        scheduler.stop()
+
+# a call put while an earlier one is still waiting replaces it
+def test_latest_queue_keeps_the_newest_call():
+    scheduler=Scheduler(ManualClock())
+    queue=LatestQueue(scheduler,"supersede")
+    calls=[]
+    for name in ("active","idle","active"):
+        queue.put(calls.append,name)
+    assert queue.depth()==1
+    scheduler.runPending()
+    assert calls==["active"]
+    assert queue.superseded==2
+
+# a burst goes out back to back, then one call a token
+def test_latest_queue_rate_limit():
+    clock=ManualClock()
+    scheduler=Scheduler(clock)
+    queue=LatestQueue(scheduler,"rate",rate=1,burst=2)
+    calls=[]
+    for name in ("a","b","c"):
+        queue.put(calls.append,name)
+        scheduler.runPending()
+    assert calls==["a","b"]
+    assert queue.deferred==1
+    # a newer call still replaces the one held back
+    queue.put(calls.append,"d")
+    clock.now=.9
+    scheduler.runPending()
+    assert calls==["a","b"]
+    clock.now=1
+    scheduler.runPending()
+    assert calls==["a","b","d"]
+
+# a playlist stays up for the dwell time before the next goes out
+def test_latest_queue_dwell():
+    clock=ManualClock()
+    scheduler=Scheduler(clock)
+    queue=LatestQueue(scheduler,"dwell",dwell=10)
+    calls=[]
+    queue.put(calls.append,"active")
+    scheduler.runPending()
+    clock.now=1
+    queue.put(calls.append,"idle")
+    assert scheduler.runPending()==9
+    clock.now=5
+    queue.put(calls.append,"active again")
+    clock.now=10
+    scheduler.runPending()
+    assert calls==["active","active again"]
+
+# a call that sent nothing takes no token and doesn't restart the dwell
+def test_latest_queue_call_that_sent_nothing():
+    clock=ManualClock()
+    scheduler=Scheduler(clock)
+    queue=LatestQueue(scheduler,"nothing",rate=1,burst=1,dwell=10)
+    calls=[]
+    def play(name):
+        calls.append(name)
+        return name!="skipped"
+    queue.put(play,"active")
+    scheduler.runPending()
+    clock.now=10
+    queue.put(play,"skipped")
+    scheduler.runPending()
+    queue.put(play,"idle")
+    scheduler.runPending()
+    assert calls==["active","skipped","idle"]
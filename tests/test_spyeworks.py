@@ -0,0 +1,205 @@
+###############################################################
+###
+###   Tests for the spyeworks client against the mock player
+###
+###############################################################
+
+import threading
+import time
+import pytest
+from spyemock import MockPlayer
+from spyeworks import Spyeworks, ReplyDecoder, PlayerDown
+
+FILEPATH="c:/users/public/documents/spyeworks/content/"
+
+# the catalog files the client writes go in a folder of their own
+@pytest.fixture(autouse=True)
+def catalogs(tmp_path,monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+# starts a mock player and a client for it, both stopped after the test
+@pytest.fixture
+def players():
+    started=[]
+    def start(player):
+        player.start()
+        spyeworks=Spyeworks(player.address,FILEPATH,"active","idle",probe=False)
+        started.append((player,spyeworks))
+        return spyeworks
+    yield start
+    for player,spyeworks in started:
+        spyeworks.close()
+        player.stop()
+
+# seconds taken by a call
+def timed(func,*args):
+    begin=time.monotonic()
+    func(*args)
+    return time.monotonic()-begin
+
+# waits up to timeout seconds for check to be true
+def waitFor(check,timeout=5):
+    end=time.monotonic()+timeout
+    while not check():
+        if time.monotonic()>end:
+            return False
+        time.sleep(.01)
+    return True
+
+# a player that answers the first SCP with an error
+class ErrorOnce(MockPlayer):
+    errored=False
+
+    def command(self,cmd):
+        if cmd.startswith('SCP') and not self.errored:
+            self.errored=True
+            return 'ERROR\r\n'
+        return MockPlayer.command(self,cmd)
+
+def test_player_without_acks_plays_straight_away(players):
+    spyeworks=players(MockPlayer(filepath=FILEPATH,current="idle"))
+    assert spyeworks.playAndConfirm("active")=="active"
+    assert not spyeworks.client.acks
+    for name in ("idle","active","idle"):
+        assert timed(spyeworks.play,name,True)<.5
+    spyeworks.getCurrentList()
+    assert spyeworks.currentList.get()=="idle"
+
+def test_player_with_acks(players):
+    spyeworks=players(MockPlayer(filepath=FILEPATH,current="idle",splreply="OK\r\n"))
+    # a plain SPL doesn't wait for an acknowledgement nobody has seen yet
+    assert timed(spyeworks.play,"active",True)<.5
+    assert not spyeworks.client.acks
+    assert spyeworks.playAndConfirm("idle")=="idle"
+    assert spyeworks.client.acks
+    for name in ("active","idle","active"):
+        assert timed(spyeworks.play,name,True)<.5
+        assert spyeworks.playAndConfirm(name)==name
+    # learnt again on each connection
+    spyeworks.client.close()
+    spyeworks.getCurrentList()
+    assert spyeworks.currentList.get()=="active"
+    assert not spyeworks.client.acks
+
+# acknowledgements still on their way from earlier switches aren't taken for the read back
+def test_late_acks_are_skipped(players):
+    spyeworks=players(MockPlayer(filepath=FILEPATH,current="idle",splreply="OK\r\n",latency=.05))
+    spyeworks.getCurrentList()
+    spyeworks.play("active",True)
+    spyeworks.play("idle",True)
+    assert spyeworks.playAndConfirm("active")=="active"
+    spyeworks.getCurrentList()
+    assert spyeworks.currentList.get()=="active"
+
+def test_error_reply_is_not_an_ack(players):
+    spyeworks=players(ErrorOnce(filepath=FILEPATH,current="idle"))
+    spyeworks.getCurrentList()
+    assert not spyeworks.client.acks
+    for name in ("active","idle"):
+        assert timed(spyeworks.play,name,True)<.5
+    assert spyeworks.playAndConfirm("active")=="active"
+
+# a switch the player ignores is corrected on the callback thread, where a subscriber
+# can call the blocking client
+def test_mismatch_is_reported_off_the_event_loop(players):
+    player=MockPlayer(filepath=FILEPATH,current="idle",strict=True)
+    player.catalog=["idle"]
+    spyeworks=players(player)
+    seen=[]
+    done=threading.Event()
+    def corrected(current):
+        try:
+            spyeworks.getCurrentList()
+            seen.append((threading.current_thread().name,current,None))
+        except Exception as error:
+            seen.append((threading.current_thread().name,current,error))
+        done.set()
+    spyeworks.play("active")
+    assert spyeworks.currentList.get()=="active"
+    spyeworks.currentList.addCallback(corrected)
+    assert done.wait(5)
+    assert seen==[("spyeworks-callbacks","idle",None)]
+    assert spyeworks.mismatch.get()['actual']=="idle"
+
+# the timings are passed on after each command, not swallowed as equal to the live dict
+def test_timings_are_reported(players):
+    spyeworks=players(MockPlayer(filepath=FILEPATH,current="idle"))
+    reported=[]
+    spyeworks.timings.addCallback(reported.append)
+    for name in ("active","idle","active"):
+        spyeworks.play(name,True)
+    assert len(reported)>0
+    assert reported[-1]==spyeworks.client.timings
+    assert reported[-1] is not spyeworks.client.timings
+
+# a list already playing isn't sent again, and the queue is told nothing went out
+def test_play_reports_whether_a_command_went_out(players):
+    player=MockPlayer(filepath=FILEPATH,current="idle")
+    spyeworks=players(player)
+    assert spyeworks.playActive() is True
+    assert spyeworks.playActive() is False
+    assert spyeworks.playActive(True) is True
+    # a plain SPL isn't answered, the mock records it in its own time
+    assert waitFor(lambda: [cmd[:3] for received,cmd in player.commands].count('SPL')==2)
+    time.sleep(.1)
+    assert [cmd[:3] for received,cmd in player.commands].count('SPL')==2
+
+# a character split across two chunks comes out whole
+def test_decoder_joins_a_character_split_across_chunks():
+    reply="caf\u00e9 1.dml\r\n".encode('utf-8')
+    split=reply.index(b'\xa9')
+    decoder=ReplyDecoder()
+    decoder.encoding='utf-8'
+    decoder.start()
+    decoder.feed(reply[:split])
+    decoder.feed(reply[split:])
+    assert decoder.finish()=="caf\u00e9 1.dml\r\n"
+
+# the encoding guessed from a plain first chunk is worked out again when it can't decode the rest
+def test_decoder_detects_again_when_the_guess_was_wrong():
+    pytest.importorskip("chardet")
+    reply=("list 1.dml\r\n"*20+"caf\u00e9 1.dml\r\n").encode('utf-8')
+    decoder=ReplyDecoder()
+    decoder.start()
+    decoder.feed(reply[:-5])
+    decoder.feed(reply[-5:])
+    assert decoder.finish()==reply.decode('utf-8')
+
+# the switch and its read back go out in one write
+def test_play_and_confirm_is_one_write(players):
+    spyeworks=players(MockPlayer(filepath=FILEPATH,current="idle"))
+    spyeworks.getCurrentList()
+    writes=[]
+    protocol=spyeworks.client.protocol
+    write=protocol.write
+    protocol.write=lambda data: (writes.append(data),write(data))
+    assert spyeworks.playAndConfirm("active")=="active"
+    assert writes==[('SPL'+FILEPATH+'active.dml\r\nSCP\r\n').encode()]
+
+# a player that goes away fails fast, keeps the latest list asked for and sends it once it is back
+def test_player_down_and_back(players):
+    player=MockPlayer(filepath=FILEPATH,current="list 0")
+    spyeworks=players(player)
+    spyeworks.client.backoff=.05
+    spyeworks.getCurrentList()
+    assert spyeworks.get()=="Online"
+    port=player.server.server_address[1]
+    player.stop()
+    # once the client has seen the connection close, a plain SPL can't go into it unnoticed
+    assert waitFor(lambda: spyeworks.client.protocol.closed)
+    spyeworks.play("active",True)
+    assert spyeworks.client.down
+    assert spyeworks.get()=="Connection Error"
+    assert timed(spyeworks.play,"idle",True)<.05
+    assert spyeworks.client.pending==(FILEPATH,"idle")
+    assert spyeworks.currentList.get()=="list 0"
+    with pytest.raises(PlayerDown):
+        spyeworks.loop.run(spyeworks.client.command('SCP\r\n',True))
+    back=MockPlayer(port=port,filepath=FILEPATH,current="list 1").start()
+    try:
+        assert waitFor(lambda: spyeworks.currentList.get()=="idle")
+        assert spyeworks.get()=="Online"
+        assert back.current=="idle"
+        assert [cmd for received,cmd in back.commands if cmd.startswith('SPL')]==['SPL'+FILEPATH+'idle.dml']
+    finally:
+        back.stop()